@@ -1,32 +1,130 @@
 from flask import Flask, render_template, request, session, escape, url_for, redirect
-import requests, json
+import requests, json, os, time
+from threading import Event, Lock, RLock, Thread
+from cache import ChainCache
+from feed import ChainFeed
+from light import LightClient
 from signature import Signature
 app = Flask(__name__)
 app.debug = True
 app.secret_key = b'_5#y2L"F4Q8z\n\xec]/'
 CONNECTED_NODE_ADDRESS = "http://127.0.0.1:8000/"
-posts = []
+# Validated headers of the node's chain, used to prove our own transactions
+light_client = LightClient(CONNECTED_NODE_ADDRESS)
+# Connections to the node are reused
+node_session = requests.Session()
+# Blocks and transactions of the node's chain, kept on disk if WALLET_CACHE is set
+cache = ChainCache(os.environ.get('WALLET_CACHE'))
+# Transactions waiting to be mined, by signature
+pending = {}
+# Held while the local view of the chain changes
+view_lock = RLock()
+# Proven balance of every address a session asked for, refreshed in the
+# background when a block comes in
+balances = {}
+balances_stale = Event()
+# Held while the light client downloads headers and proofs
+light_lock = Lock()
+
+def fetch_blocks(last_hash):
+    """
+    Fetch the blocks after `last_hash` from the node, following /blocks
+    pages. If the node doesn't know that block anymore, start over.
+    :return: (blocks, True if they replace what we have)
+    """
+    get_blocks_address = "{}blocks".format(CONNECTED_NODE_ADDRESS)
+    params = {'after': last_hash} if last_hash else {'since': 0}
+    response = node_session.get(get_blocks_address, params=params)
+    reset = last_hash is None
+    if response.status_code == 404:
+        response = node_session.get(get_blocks_address, params={'since': 0})
+        reset = True
+
+    blocks = []
+    while response.status_code == 200:
+        page = json.loads(response.content)
+        blocks.extend(page["blocks"])
+        since = page["since"] + len(page["blocks"])
+        if not page["blocks"] or since >= page["length"]:
+            break
+        response = node_session.get(get_blocks_address, params={'since': since})
+    return blocks, reset
 
 def fetch_posts():
     """
-    Function to fetch the chain from a blockchain node, parse the
-    data, and store it locally.
+    Function to fetch the new blocks from a blockchain node, parse the
+    data, and store it locally. The download runs outside of `view_lock`,
+    requests reading the view don't wait for the node.
+    """
+    while True:
+        last_hash = cache.last_hash
+        blocks, reset = fetch_blocks(last_hash)
+        with view_lock:
+            # Unless the view moved in the meantime, then fetch again
+            if reset or cache.last_hash == last_hash:
+                if reset:
+                    drop_blocks(0)
+                add_blocks(blocks)
+                return
+
+def add_blocks(blocks):
+    cache.add_blocks(blocks)
+    for block in blocks:
+        for tx in block["transactions"]:
+            pending.pop(tx.get("signature"), None)
+    if blocks:
+        balances_stale.set()
+
+def drop_blocks(height):
+    """
+    Forget the blocks from `height` on, the node switched to another branch.
+    """
+    cache.truncate(height)
+    balances_stale.set()
+
+def on_event(kind, data):
+    """
+    Keep the local view up to date from the node's /events stream.
     """
-    get_chain_address = "{}chain".format(CONNECTED_NODE_ADDRESS)
-    response = requests.get(get_chain_address)
-    if response.status_code == 200:
-        content = []
-        chain = json.loads(response.content)
-        for block in chain["chain"]:
-            for tx in block["transactions"]:
-                tx["index"] = block["index"]
-                tx["hash"] = block["previous_hash"]
-                content.append(tx)
-
-        global posts
-        posts = sorted(content,
-                       key=lambda k: k['timestamp'],
-                       reverse=True)
+    missed = kind == "reset"
+    with view_lock:
+        if kind == "new-block":
+            block = data["block"]
+            height = data["height"]
+            if height < len(cache) and cache.hashes[height] == block["hash"]:
+                return
+            if height != len(cache) or (len(cache) and block["previous_hash"] != cache.last_hash):
+                missed = True
+            else:
+                add_blocks([block])
+        elif kind == "reorg":
+            drop_blocks(data["height"])
+        elif kind == "new-transaction":
+            for tx in data["transactions"]:
+                pending[tx["signature"]] = tx
+    if missed:
+        # We missed something, fetch what changed
+        fetch_posts()
+
+def refresh_balances():
+    """
+    Prove the new transactions of the known addresses after every change
+    of the chain, so that /amounts doesn't wait for the node.
+    """
+    while True:
+        balances_stale.wait()
+        balances_stale.clear()
+        for address in list(balances):
+            try:
+                with light_lock:
+                    balances[address] = light_client.balance(address)
+            except (requests.RequestException, ValueError):
+                balances_stale.set()
+        if balances_stale.is_set():
+            time.sleep(feed.retry)
+
+# Pushes the changes of the node's chain, the cache is only updated from it
+feed = ChainFeed(CONNECTED_NODE_ADDRESS, on_event)
 
 @app.route('/')
 def index():
@@ -42,10 +140,12 @@ def login():
     if not all(k in data for k in required_fields):
         return "Bad Request", 400
     try:
-        Signature.get_public_key(data['private_key'])
+        public_key = Signature.get_public_key(data['private_key'])
     except Exception as e:
         return "Private key is not valid"
     session['private_key'] = data['private_key']
+    # Derived once per session
+    session['public_key'] = public_key
     return 'Success'
 
 @app.route("/key")
@@ -53,8 +153,22 @@ def key():
     return session['private_key']
 
 @app.route("/posts")
-def posts():
-    return json.dumps(posts)
+def get_posts():
+    """
+    Mined transactions newest first, from the local cache. ?offset= and
+    ?limit= select a page, ?address= the transactions of one address, the
+    total is in the X-Total-Count header.
+    """
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = request.args.get('limit', type=int)
+    with view_lock:
+        total, transactions = cache.page(offset, limit, request.args.get('address'))
+        return json.dumps(transactions), 200, {'X-Total-Count': str(total)}
+
+@app.route("/pending")
+def get_pending():
+    with view_lock:
+        return json.dumps(sorted(pending.values(), key=lambda k: k['timestamp'], reverse=True))
 
 @app.route("/amounts")
 def get_money():
@@ -64,14 +178,20 @@ def get_money():
 
 
 def get_amount():
-    fetch_posts()
-    init_amount = 1000
-    for post in posts:
-        if post['sender'] == Signature.get_public_key(session['private_key']):
-            init_amount -= post['amount']
-        if post['receiver'] == Signature.get_public_key(session['private_key']):
-            init_amount += post['amount']
-    return init_amount
+    """
+    Balance of the logged in account, from its own transactions proven
+    against the validated headers.
+    """
+    public_key = session_public_key()
+    if public_key not in balances:
+        with light_lock:
+            balances[public_key] = light_client.balance(public_key)
+    return balances[public_key]
+
+def session_public_key():
+    if 'public_key' not in session:
+        session['public_key'] = Signature.get_public_key(session['private_key'])
+    return session['public_key']
 
 @app.route("/transaction", methods=['POST'])
 def create_transaction():
@@ -84,7 +204,7 @@ def create_transaction():
     init_amount = get_amount()
     if init_amount >= data['amount']:
         trans = {
-            'sender': Signature.get_public_key(session['private_key']),
+            'sender': session_public_key(),
             'receiver': data['receiver'],
             'amount': data['amount']
         }
@@ -92,7 +212,7 @@ def create_transaction():
         trans['signature'] = signature
         headers = {'Content-Type': "application/json"}
         url = "{}new_transaction".format(CONNECTED_NODE_ADDRESS)
-        response = requests.post(url, data=json.dumps(trans), headers=headers)
+        response = node_session.post(url, data=json.dumps(trans), headers=headers)
         if response.ok:
             return 'Success'
         else:
@@ -103,4 +223,6 @@ def create_transaction():
 
 if __name__ == '__main__':
     fetch_posts()
+    feed.start(len(cache))
+    Thread(target=refresh_balances, daemon=True).start()
     app.run()
\ No newline at end of file
@@ -0,0 +1,111 @@
+from bisect import bisect_right
+import json
+import os
+
+
+class ChainCache:
+    """
+    The wallet's copy of the node's chain: the blocks, the transactions
+    sorted by timestamp and the transactions of each address. Blocks are
+    saved one JSON per line to `path`, if given, so that a restart only
+    downloads the new ones.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        # Hash of every block, by height
+        self.hashes = []
+        # Transactions oldest first, and their timestamps for bisect
+        self.transactions = []
+        self._timestamps = []
+        # Address -> transactions sent or received, in chain order
+        self.by_address = {}
+        # File offset of every block, to drop them after a reorg
+        self._offsets = []
+        self._end = 0
+        self._file = None
+        if path is not None:
+            self._load()
+
+    def __len__(self):
+        return len(self.hashes)
+
+    @property
+    def last_hash(self):
+        return self.hashes[-1] if self.hashes else None
+
+    def _load(self):
+        """
+        Read the saved blocks, a line left half written by a crash is dropped.
+        """
+        end = 0
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    try:
+                        block = json.loads(line)
+                    except ValueError:
+                        break
+                    if self.hashes and block['previous_hash'] != self.hashes[-1]:
+                        break
+                    self._offsets.append(end)
+                    self._index(block)
+                    end += len(line)
+        self._file = open(self.path, 'ab')
+        self._file.truncate(end)
+        self._end = end
+
+    def _index(self, block):
+        for tx in block["transactions"]:
+            tx["index"] = block["index"]
+            tx["hash"] = block["previous_hash"]
+            position = bisect_right(self._timestamps, tx["timestamp"])
+            self._timestamps.insert(position, tx["timestamp"])
+            self.transactions.insert(position, tx)
+            for address in {tx.get("sender"), tx.get("receiver")}:
+                self.by_address.setdefault(address, []).append(tx)
+        self.hashes.append(block["hash"])
+
+    def add_blocks(self, blocks):
+        for block in blocks:
+            if self._file is not None:
+                data = json.dumps(block).encode() + b'\n'
+                self._file.write(data)
+                self._offsets.append(self._end)
+                self._end += len(data)
+            self._index(block)
+        if self._file is not None and blocks:
+            self._file.flush()
+
+    def truncate(self, height):
+        """
+        Drop the blocks from `height` on, the node switched to another branch.
+        """
+        if height >= len(self.hashes):
+            return
+        keep = [i for i, tx in enumerate(self.transactions) if tx["index"] < height]
+        self.transactions = [self.transactions[i] for i in keep]
+        self._timestamps = [self._timestamps[i] for i in keep]
+        for address, transactions in list(self.by_address.items()):
+            while transactions and transactions[-1]["index"] >= height:
+                transactions.pop()
+            if not transactions:
+                del self.by_address[address]
+        del self.hashes[height:]
+        if self._file is not None:
+            self._end = self._offsets[height]
+            self._file.truncate(self._end)
+            del self._offsets[height:]
+
+    def page(self, offset=0, limit=None, address=None):
+        """
+        Transactions newest first, of `address` only if given.
+        :return: (total, transactions)
+        """
+        transactions = self.transactions if address is None else self.by_address.get(address, [])
+        total = len(transactions)
+        end = total - offset
+        start = 0 if limit is None else max(end - limit, 0)
+        return total, transactions[start:max(end, 0)][::-1]
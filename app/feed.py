@@ -0,0 +1,57 @@
+from threading import Thread
+import time
+
+import requests
+
+
+class ChainFeed:
+    """
+    Follows the events of a node in a background thread, long-polling
+    /events, and hands every event to `handler(type, data)`. Reconnects
+    after errors, resuming after the last event received.
+    """
+    # Seconds before reconnecting
+    retry = 1
+    # The node answers a poll after 30 seconds at the latest
+    read_timeout = 60
+
+    def __init__(self, node_address, handler):
+        self.node_address = node_address
+        self.handler = handler
+        self.session = requests.Session()
+        self.last_id = None
+        self.since = 0
+        self.connected = False
+
+    def start(self, since):
+        """
+        :param since: Height of the first block we don't have
+        """
+        self.since = since
+        Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            try:
+                self._poll()
+                continue
+            except (requests.RequestException, ValueError):
+                pass
+            self.connected = False
+            time.sleep(self.retry)
+
+    def _poll(self):
+        params = {'poll': 1}
+        if self.last_id is not None:
+            params['after'] = self.last_id
+        else:
+            # Answered right away, with the id to poll after
+            params['since'], params['timeout'] = self.since, 0
+        response = self.session.get(self.node_address + 'events', params=params,
+                                    timeout=(5, self.read_timeout))
+        response.raise_for_status()
+        self.connected = True
+        answer = response.json()
+        for event in answer['events']:
+            self.handler(event['type'], event['data'])
+        self.last_id = answer['last_id']
@@ -0,0 +1,149 @@
+from hashlib import sha256
+import json
+import requests
+
+from merkle import transaction_hash, verify_proof
+
+# Fields of a block header covered by its hash
+HEADER_FIELDS = ('index', 'merkle_root', 'nonce', 'previous_hash', 'timestamp')
+
+
+def header_hash(header) -> str:
+    header_string = json.dumps({k: header[k] for k in HEADER_FIELDS}, sort_keys=True)
+    return sha256(header_string.encode()).hexdigest()
+
+
+class LightClient:
+    """
+    Wallet side view of a node: keeps only the validated block headers and
+    checks the transactions of an address with Merkle inclusion proofs,
+    instead of downloading the whole chain.
+    """
+    difficulty = 2
+    initial_balance = 1000
+    page_size = 100
+
+    def __init__(self, node_address):
+        self.node_address = node_address
+        self.session = requests.Session()
+        # Validated headers by height
+        self.headers = []
+        # Address -> {signature: (height, transaction)} proven to be mined
+        self.verified = {}
+
+    def _valid(self, header, previous):
+        if header['merkle_root'] is None:
+            # Legacy block, its hash covers transactions we don't download so
+            # it can't be checked, only a trusted genesis block may be one
+            return previous is None
+        if header_hash(header) != header['hash']:
+            return False
+        # The genesis block is trusted, it isn't mined
+        return previous is None or (header['previous_hash'] == previous['hash'] and
+                                    header['hash'].startswith('0' * self.difficulty))
+
+    def _get_headers(self, params):
+        """
+        :return: (length of the node's chain, headers), None if the node
+                 doesn't know the block asked for
+        """
+        response = self.session.get(self.node_address + 'headers', params=params, stream=True)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        lines = response.iter_lines()
+        meta = json.loads(next(lines))
+        return meta['length'], [json.loads(line) for line in lines if line]
+
+    def _rollback(self, length):
+        del self.headers[length:]
+        for verified in self.verified.values():
+            for signature in [s for s, (height, _) in verified.items() if height >= length]:
+                del verified[signature]
+
+    def sync(self):
+        """
+        Download and validate the headers after our tip. If the node
+        doesn't know our tip anymore, step back until it knows a header.
+        """
+        height, step = len(self.headers) - 1, 1
+        result = None
+        while height >= 0:
+            result = self._get_headers({'after': self.headers[height]['hash']})
+            if result is not None:
+                break
+            height, step = height - step, step * 2
+        if result is None:
+            height = -1
+            result = self._get_headers({'since': 0})
+        self._rollback(height + 1)
+
+        length, headers = result
+        while headers:
+            for header in headers:
+                if not self._valid(header, self.headers[-1] if self.headers else None):
+                    raise ValueError("Invalid header at height {}".format(header['index']))
+                self.headers.append(header)
+            if len(self.headers) >= length:
+                break
+            length, headers = self._get_headers({'since': len(self.headers)})
+
+    def _verify(self, signature):
+        """
+        Check the inclusion proof of a transaction against our headers.
+        :return: (height, transaction) or None
+        """
+        response = self.session.get('{}tx/{}/proof'.format(self.node_address, signature))
+        if response.status_code != 200:
+            return None
+        proof = response.json()
+        height = proof['height']
+        if height >= len(self.headers) or self.headers[height]['hash'] != proof['header']['hash']:
+            return None
+        tx = proof['transaction']
+        if tx.get('signature') != signature or not verify_proof(
+                transaction_hash(tx), proof['proof'], self.headers[height]['merkle_root']):
+            return None
+        return height, tx
+
+    def _total(self, address):
+        url = '{}address/{}/txs'.format(self.node_address, address)
+        return self.session.get(url, params={'limit': 0}).json()['total']
+
+    def _history(self, address, offset, count):
+        url = '{}address/{}/txs'.format(self.node_address, address)
+        transactions = []
+        while count > 0:
+            page = self.session.get(url, params={'offset': offset,
+                                                 'limit': min(count, self.page_size)}).json()
+            if not page['transactions']:
+                break
+            transactions.extend(page['transactions'])
+            offset += len(page['transactions'])
+            count -= len(page['transactions'])
+        return transactions
+
+    def transactions(self, address):
+        """
+        Proven transactions of `address`, only the new ones are downloaded.
+        """
+        self.sync()
+        verified = self.verified.setdefault(address, {})
+        total = self._total(address)
+        if total < len(verified):
+            verified.clear()
+        for tx in self._history(address, 0, total - len(verified)):
+            if tx['signature'] not in verified:
+                result = self._verify(tx['signature'])
+                if result is not None:
+                    verified[tx['signature']] = result
+        return verified
+
+    def balance(self, address):
+        amount = self.initial_balance
+        for _, tx in self.transactions(address).values():
+            if tx['sender'] == address:
+                amount -= tx['amount']
+            if tx['receiver'] == address:
+                amount += tx['amount']
+        return amount
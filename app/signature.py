@@ -1,13 +1,53 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import os
 from Crypto.Signature import DSS
 from Crypto.Hash import SHA256
 from Crypto.PublicKey import ECC
 
+# Number of parsed public keys and verifiers kept in memory. Private keys
+# are never cached, they would stay in memory for the life of the process.
+KEY_CACHE_SIZE = 4096
+
+
+def _import_key(key):
+    return ECC.import_key(bytes.fromhex(key))
+
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def _import_public_key(public_key):
+    return _import_key(public_key)
+
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def _verifier(public_key):
+    return DSS.new(_import_public_key(public_key), Signature.dss_mode)
+
+
+def _verify_many(items):
+    """
+    :param items: [(public_key, signature, data)]
+    :return: [True if authentic]
+    """
+    results = []
+    for public_key, signature, data in items:
+        try:
+            Signature.verify(public_key, signature, data)
+            results.append(True)
+        except (ValueError, TypeError):
+            results.append(False)
+    return results
+
 
 class Signature:
     encoding = 'utf-8'
     dss_mode = 'fips-186-3'
     ecc_curve = 'secp256r1'
     key_format = 'DER'
+    # Batches smaller than this are verified in the calling process
+    parallel_threshold = 64
+    batch_workers = None
+    _executor = None
 
     @staticmethod
     def generate():
@@ -23,7 +63,7 @@ class Signature:
 
     @staticmethod
     def get_public_key(private_key):
-        _private_key = ECC.import_key(bytes.fromhex(private_key))
+        _private_key = _import_key(private_key)
         _public_key = _private_key.public_key()
         der_pub = _public_key.export_key(format=Signature.key_format)
         return der_pub.hex()
@@ -39,7 +79,7 @@ class Signature:
         bytes_data = data.encode(Signature.encoding)
         hash_data = SHA256.new(bytes_data)
 
-        prv_key = ECC.import_key(bytes.fromhex(private_key))
+        prv_key = _import_key(private_key)
 
         signer = DSS.new(prv_key, Signature.dss_mode)
         signature = signer.sign(hash_data)
@@ -61,12 +101,30 @@ class Signature:
                    print "The message is not authentic."
         """
         _signature = bytes.fromhex(signature)
-        _public_key = ECC.import_key(bytes.fromhex(public_key))
 
         bytes_data = data.encode(Signature.encoding)
         hash_data = SHA256.new(bytes_data)
 
-        verify_key = DSS.new(_public_key, Signature.dss_mode)
+        verify_key = _verifier(public_key)
         return verify_key.verify(hash_data, _signature)
 
+    @staticmethod
+    def verify_batch(items):
+        """
+        Verify many signatures, spread across a process pool for big batches.
+        :param items: List of (public_key, signature, data)
+        :return: List of bool, True when the signature is authentic
+        """
+        items = list(items)
+        if len(items) < Signature.parallel_threshold:
+            return _verify_many(items)
 
+        workers = Signature.batch_workers or os.cpu_count() or 1
+        if Signature._executor is None:
+            Signature._executor = ProcessPoolExecutor(workers)
+        size = -(-len(items) // workers)
+        chunks = [items[i:i + size] for i in range(0, len(items), size)]
+        results = []
+        for chunk_results in Signature._executor.map(_verify_many, chunks):
+            results.extend(chunk_results)
+        return results
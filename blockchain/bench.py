@@ -0,0 +1,211 @@
+"""
+Benchmarks of the node on synthetic chains.
+
+    python bench.py --lengths 10,100,500 --transactions 10 --output before.json
+
+Every result is written as one JSON document, run the same command on two
+versions and compare the files to spot regressions.
+"""
+from argparse import ArgumentParser
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from block import Block
+from blockchain import Blockchain
+from merkle import merkle_root
+from miner import ParallelMiner, SerialMiner
+from signature import Signature
+from transaction import signed_message
+
+
+def rate(function, seconds):
+    """
+    Call `function` repeatedly for about `seconds`.
+    :return: calls per second
+    """
+    calls = 0
+    started = time.perf_counter()
+    while True:
+        function()
+        calls += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= seconds:
+            return calls / elapsed
+
+
+def timed(function):
+    """
+    :return: (seconds taken by one call, result)
+    """
+    started = time.perf_counter()
+    result = function()
+    return time.perf_counter() - started, result
+
+
+def make_transactions(keys, count, start=0):
+    transactions = []
+    for i in range(count):
+        (private_key, sender), (_, receiver) = keys[(start + i) % len(keys)], keys[(start + i + 1) % len(keys)]
+        tx = {"sender": sender, "receiver": receiver, "amount": 1 + i % 10}
+        tx["signature"] = Signature.sign(private_key, signed_message(tx))
+        tx["timestamp"] = float(start + i)
+        transactions.append(tx)
+    return transactions
+
+
+def build_chain(length, transactions_per_block, keys):
+    """
+    A valid chain dump of `length` blocks, timestamps are fixed so that
+    only the nonces and signatures differ from one run to the other.
+    """
+    genesis = Block(0, [], 0, 0, merkle_root=merkle_root([]))
+    genesis.compute_hash()
+    chain = [genesis]
+    miner = SerialMiner()
+    for index in range(1, length):
+        transactions = make_transactions(keys, transactions_per_block, index * transactions_per_block)
+        block = Block(index, transactions, index, chain[-1].hash,
+                      merkle_root=merkle_root(transactions))
+        block.hash = miner.mine(block, Blockchain.difficulty)
+        chain.append(block)
+    return [block.to_dict() for block in chain]
+
+
+def bench_compute_hash(transactions, seconds):
+    block = Block(1, transactions, 1, '0' * 64, merkle_root=merkle_root(transactions))
+    legacy = Block(1, transactions, 1, '0' * 64)
+    hasher = block.nonce_hasher()
+    return {
+        "hashes_per_sec": rate(block.compute_hash, seconds),
+        "legacy_hashes_per_sec": rate(legacy.compute_hash, seconds),
+        "nonce_hasher_per_sec": rate(lambda: hasher.hash(12345), seconds),
+    }
+
+
+def bench_proof_of_work(transactions, difficulties, seconds, workers):
+    miner = ParallelMiner(workers) if workers else SerialMiner()
+    results = {}
+    for difficulty in difficulties:
+        attempts = elapsed = blocks = 0
+        while elapsed < seconds:
+            block = Block(blocks + 1, transactions, time.time(), '0' * 64,
+                          merkle_root=merkle_root(transactions))
+            miner.mine(block, difficulty)
+            attempts += miner.last_stats["attempts"]
+            elapsed += miner.last_stats["elapsed"]
+            blocks += 1
+        results[str(difficulty)] = {
+            "blocks": blocks,
+            "seconds_per_block": elapsed / blocks,
+            "hashes_per_sec": attempts / elapsed if elapsed else 0.0,
+        }
+    if workers:
+        miner.close()
+    return {"workers": workers or 1, "difficulties": results}
+
+
+def bench_signatures(keys, seconds):
+    private_key, public_key = keys[0]
+    message = signed_message({"sender": public_key, "receiver": keys[1][1], "amount": 1})
+    signature = Signature.sign(private_key, message)
+    items = [(public_key, signature, message)] * 256
+    return {
+        "sign_per_sec": rate(lambda: Signature.sign(private_key, message), seconds),
+        "verify_per_sec": rate(lambda: Signature.verify(public_key, signature, message), seconds),
+        "verify_batch_per_sec": rate(lambda: Signature.verify_batch(items), seconds) * len(items),
+    }
+
+
+def bench_chain(chain_dump, lengths):
+    """
+    Time to validate and to serve chains of every length in `lengths`.
+    """
+    import server
+    client = server.app.test_client()
+    results = {}
+    for length in lengths:
+        dump = chain_dump[:length]
+        blocks = [Block.from_dict(block_data) for block_data in dump]
+        check_time, valid = timed(lambda: Blockchain.check_chain_validity(blocks))
+
+        # A node that only knows the genesis block receives the whole chain
+        server.blockchain = Blockchain()
+        server.blockchain.append(Block.from_dict(dump[0]))
+        server.validator.reset(server.blockchain.hashes)
+        verify_time, (height, verified) = timed(lambda: server.verify_chain_dump(dump))
+        server.adopt_chain(height, verified)
+
+        json_time, response = timed(lambda: client.get('/chain'))
+        json_size = len(response.data)
+        gzip_time, response = timed(lambda: client.get('/chain', headers={'Accept-Encoding': 'gzip'}))
+        gzip_size = len(response.data)
+        binary_time, response = timed(lambda: client.get('/chain', headers={'Accept': 'application/x-blockchain'}))
+        binary_size = len(response.data)
+        results[str(length)] = {
+            "valid": valid and len(server.blockchain.chain) == length,
+            "check_chain_validity_sec": check_time,
+            "verify_chain_dump_sec": verify_time,
+            "chain_json_sec": json_time,
+            "chain_json_bytes": json_size,
+            "chain_gzip_sec": gzip_time,
+            "chain_gzip_bytes": gzip_size,
+            "chain_binary_sec": binary_time,
+            "chain_binary_bytes": binary_size,
+            "memory": server.blockchain.memory_footprint(),
+        }
+    return results
+
+
+def environment():
+    try:
+        revision = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                           cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {
+        "revision": revision,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "time": time.time(),
+    }
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--lengths', default='10,100,500',
+                        help='comma separated chain lengths to validate and serve')
+    parser.add_argument('--transactions', type=int, default=10, help='transactions per block')
+    parser.add_argument('--difficulties', default='1,2,3', help='comma separated mining difficulties')
+    parser.add_argument('--workers', type=int, default=0, help='mining processes, 0 for the serial miner')
+    parser.add_argument('--seconds', type=float, default=1.0, help='duration of each throughput measure')
+    parser.add_argument('--output', help='JSON file to write, standard output by default')
+    args = parser.parse_args()
+
+    lengths = sorted(int(length) for length in args.lengths.split(','))
+    difficulties = [int(difficulty) for difficulty in args.difficulties.split(',')]
+    keys = [Signature.generate() for _ in range(10)]
+    transactions = make_transactions(keys, args.transactions)
+
+    results = {"environment": environment(), "parameters": vars(args)}
+    results["compute_hash"] = bench_compute_hash(transactions, args.seconds)
+    results["proof_of_work"] = bench_proof_of_work(transactions, difficulties, args.seconds, args.workers)
+    results["signatures"] = bench_signatures(keys, args.seconds)
+    build_time, chain_dump = timed(lambda: build_chain(lengths[-1], args.transactions, keys))
+    results["build_chain_sec"] = build_time
+    results["chain"] = bench_chain(chain_dump, lengths)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
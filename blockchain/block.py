@@ -1,14 +1,24 @@
 from hashlib import sha256
 import json
 
+from compact import pack_transaction, unpack_transaction
+from merkle import merkle_root
+
 class Block:
-    def __init__(self, index, transactions, timestamp, previous_hash, nonce=0):
+    # Blocks are the bulk of a node's memory, no per-instance __dict__.
+    # Transactions are kept packed and unpacked when read.
+    __slots__ = ('index', '_transactions', 'timestamp', 'previous_hash', 'hash',
+                 'nonce', 'merkle_root')
+
+    def __init__(self, index, transactions, timestamp, previous_hash, nonce=0, merkle_root=None):
         """
         Constructor for the `Block` class.
         :param index: Unique ID of the block.
         :param transactions: List of transactions.
         :param timestamp: Time of generation of the block.
         :param previous_hash: Hash of the previous block in the chain which this block is part of. 
+        :param merkle_root: Merkle root of the transactions. Blocks without one
+                            are legacy blocks, hashed with all their transactions.
         """
         self.index = index
         self.transactions = transactions
@@ -16,25 +26,154 @@ class Block:
         self.previous_hash = previous_hash
         self.hash = ""
         self.nonce = nonce
-        # self.block_chain_difficulty = 0
-    
+        self.merkle_root = merkle_root
+
+    @property
+    def transactions(self) -> list:
+        return [unpack_transaction(tx) for tx in self._transactions]
+
+    @transactions.setter
+    def transactions(self, transactions):
+        self._transactions = tuple(pack_transaction(tx) for tx in transactions)
+
+    def transaction(self, position) -> dict:
+        return unpack_transaction(self._transactions[position])
+
+    def transaction_count(self) -> int:
+        return len(self._transactions)
+
+    def transactions_size(self) -> int:
+        """
+        Bytes of the JSON of the transactions, as the mempool counts them.
+        """
+        return sum(len(json.dumps(tx)) for tx in self.transactions)
+
+    def fits(self, max_transactions, max_bytes) -> bool:
+        """
+        The block holds at most `max_transactions` transactions of at most
+        `max_bytes` bytes in all.
+        """
+        return self.transaction_count() <= max_transactions and \
+            self.transactions_size() <= max_bytes
+
+    def to_dict(self) -> dict:
+        """
+        The JSON form of the block, as sent to peers and stored.
+        """
+        return {
+            "index": self.index,
+            "transactions": self.transactions,
+            "timestamp": self.timestamp,
+            "previous_hash": self.previous_hash,
+            "hash": self.hash,
+            "nonce": self.nonce,
+            "merkle_root": self.merkle_root,
+        }
+
+    @classmethod
+    def from_dict(cls, block_data):
+        """
+        Build a block from its JSON form, `hash` is copied when present.
+        """
+        block = cls(block_data["index"],
+                    block_data["transactions"],
+                    block_data["timestamp"],
+                    block_data["previous_hash"],
+                    block_data["nonce"],
+                    block_data.get("merkle_root"))
+        block.hash = block_data.get("hash", "")
+        return block
+
+    def header(self) -> dict:
+        """
+        The fields covered by the hash: a fixed-size header chaining the
+        Merkle root, or the whole block for legacy blocks.
+        """
+        header = {
+            "index": self.index,
+            "nonce": self.nonce,
+            "previous_hash": self.previous_hash,
+            "timestamp": self.timestamp,
+        }
+        if self.merkle_root is None:
+            header["transactions"] = self.transactions
+        else:
+            header["merkle_root"] = self.merkle_root
+        return header
+
+    def light_header(self) -> dict:
+        """
+        Header sent to light clients: the hashed header without the
+        transactions of legacy blocks, plus the hash.
+        """
+        return {
+            "index": self.index,
+            "nonce": self.nonce,
+            "previous_hash": self.previous_hash,
+            "timestamp": self.timestamp,
+            "merkle_root": self.merkle_root,
+            "hash": self.hash,
+        }
+
+    def has_valid_merkle_root(self) -> bool:
+        """
+        The Merkle root matches the transactions, none of which is repeated.
+        """
+        transactions = self.transactions
+        if len({tx.get('signature') for tx in transactions}) != len(transactions):
+            return False
+        return self.merkle_root is None or self.merkle_root == merkle_root(transactions)
+
     def compute_hash(self) -> str:
         """
-        Returns the hash of the block instance by first converting it
-        into JSON string.
+        Returns the hash of the block instance by first converting its
+        header into JSON string.
         """
-        delattr(self, "hash")
-        block_string = json.dumps(self.__dict__, sort_keys=True)
+        block_string = json.dumps(self.header(), sort_keys=True)
         self.hash = sha256(block_string.encode()).hexdigest()
         return self.hash
 
+    def nonce_hasher(self):
+        """
+        Returns a `NonceHasher` for the current content of the block, to
+        hash many nonces without serializing the block again.
+        """
+        return NonceHasher(self.header())
+
     @staticmethod
     def compute_hash_from_dict(block):
-        block_string = json.dumps(block, sort_keys=True)
-        return sha256(block_string.encode()).hexdigest()
+        return Block.from_dict(block).compute_hash()
+
+class NonceHasher:
+    """
+    Hashes a block for many nonces. The JSON of the block is split around
+    the nonce value once, the sha256 state of the constant prefix is kept
+    and only the nonce and the suffix are fed for each attempt. Gives the
+    same hashes as `Block.compute_hash`.
+    """
+    # Placeholder nonce, only "index" and the hex "merkle_root" sort before
+    # "nonce" so the first occurrence in the JSON is always the real field
+    marker = '"\\u0000nonce\\u0000"'
+
+    def __init__(self, block_data):
+        block_data = dict(block_data, nonce='\u0000nonce\u0000')
+        block_string = json.dumps(block_data, sort_keys=True)
+        prefix, _, suffix = block_string.partition(NonceHasher.marker)
+        self.prefix = prefix.encode()
+        self.suffix = suffix.encode()
+        self._state = sha256(self.prefix)
+
+    def __getstate__(self):
+        # hashlib objects can't be pickled, rebuild the state in workers
+        return {'prefix': self.prefix, 'suffix': self.suffix}
 
-# t = {"a" : "b"}
+    def __setstate__(self, state):
+        self.prefix = state['prefix']
+        self.suffix = state['suffix']
+        self._state = sha256(self.prefix)
 
-# b = Block(1, [t], 1590910438)
-# print(b.__dict__)
-# print(b.compute_hash())
\ No newline at end of file
+    def hash(self, nonce: int) -> str:
+        h = self._state.copy()
+        h.update(str(nonce).encode())
+        h.update(self.suffix)
+        return h.hexdigest()
@@ -1,23 +1,238 @@
+from collections import OrderedDict
+
 from block import Block
+from compact import deep_size
+from index import AddressIndex
+from mempool import Mempool
+from merkle import merkle_root
+from metrics import Histogram, timed
+from miner import SerialMiner
+from pool import BlockPool
+import json
 import time
 
+POW_SECONDS = Histogram('blockchain_pow_seconds', 'Time spent finding a proof of work')
+POW_HASH_RATE = Histogram('blockchain_pow_hash_rate', 'Hashes per second of each proof of work',
+                          buckets=(1e3, 1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7))
+
+
+class _RecentFragments:
+    """
+    JSON of the blocks of an in-memory chain. Only the JSON of the last
+    `cache_size` appended blocks is kept, that of older blocks is built
+    again when read. A truncated chain gets a new view, streams of /chain
+    keep the blocks of the view they started with.
+    """
+
+    def __init__(self, cache_size, blocks=None, cache=None):
+        self.cache_size = cache_size
+        self.blocks = [] if blocks is None else blocks
+        # Block hash -> JSON, oldest first, shared by the views of a chain
+        self.cache = OrderedDict() if cache is None else cache
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def fragment(self, height) -> str:
+        block = self.blocks[height]
+        fragment = self.cache.get(block.hash)
+        if fragment is None:
+            fragment = json.dumps(block.to_dict())
+        return fragment
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self.fragment(i) for i in range(*item.indices(len(self)))]
+        return self.fragment(item)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.fragment(i)
+
+    def append(self, block, fragment):
+        self.blocks.append(block)
+        self.cache[block.hash] = fragment
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def truncated(self, length):
+        return _RecentFragments(self.cache_size, self.blocks[:length], self.cache)
+
 
 class Blockchain:
     difficulty = 2
+    # Mining engine used by `proof_of_work`, see miner.py
+    miner = SerialMiner()
+    # Blocks between two snapshots of a persistent chain, and the format of
+    # the snapshots, older ones are ignored and the whole store is replayed
+    checkpoint_interval = 1000
+    snapshot_version = 2
+    # Budget of a block, mined or received, larger blocks are invalid
+    block_max_transactions = 1000
+    block_max_bytes = 1024 * 1024
+    # Side branches forking deeper than this below our tip are forgotten
+    max_reorg_depth = 100
+    # Blocks of an in-memory chain whose JSON is kept, the latest ones.
+    # Their JSON is most of the chain's memory, about twice its blocks.
+    fragment_cache_size = 256
+
+    def __init__(self, store=None):
+        """
+        :param store: `BlockStore` keeping the chain on disk, the chain is only
+                      kept in memory without it.
+        """
+        self.unconfirmed_transactions = Mempool()
+        self.store = store
+        # Hash of every block, and hash -> height for range queries by hash
+        self.hashes = []
+        self.heights = {}
+        if store is None:
+            self.chain = []
+            # JSON of the blocks, see `_RecentFragments`
+            self.fragments = _RecentFragments(self.fragment_cache_size)
+        else:
+            self.chain = store.blocks
+            self.fragments = store.fragments
+        self.index = AddressIndex(self.chain)
+        # Valid blocks off our chain, see `receive_block`
+        self.pool = BlockPool()
+        # Called with ("append", height, fragment) and ("truncate", length)
+        # whenever the chain changes
+        self.listeners = []
+        if store is not None:
+            self._restore()
+
+    def _restore(self):
+        """
+        Load the last snapshot of the store and replay the blocks after it.
+        """
+        snapshot = self.store.load_snapshot()
+        start = 0
+        if snapshot is not None and snapshot.get('version') == self.snapshot_version:
+            start = snapshot['length']
+            self.hashes = snapshot['hashes']
+            self.index.load(snapshot['index'])
+            for tx in snapshot['pending']:
+                self.unconfirmed_transactions.add(tx)
+        for height in range(start, len(self.store)):
+            block = self.store.block(height)
+            self.hashes.append(block.hash)
+            self.index.apply(block, height)
+        self.heights = {block_hash: height for height, block_hash in enumerate(self.hashes)}
 
-    def __init__(self):
-        self.unconfirmed_transactions = []
-        self.chain = []
+    def checkpoint(self):
+        """
+        Snapshot the derived state of a persistent chain.
+        """
+        if self.store is None:
+            return
+        self.store.save_snapshot({
+            "version": self.snapshot_version,
+            "length": len(self.hashes),
+            "hashes": self.hashes,
+            "index": self.index.state(),
+            "pending": list(self.unconfirmed_transactions),
+        })
+
+    def memory_footprint(self) -> dict:
+        """
+        Bytes held in memory by the chain and the state derived from it.
+        Shared objects are counted once, in the first part reaching them.
+        The JSON of the blocks is only held for the last
+        `fragment_cache_size` blocks, or not at all with a store.
+        """
+        seen = set()
+        if self.store is None:
+            blocks = deep_size(self.chain, seen)
+            fragments = deep_size(self.fragments, seen)
+        else:
+            # Only the cached blocks are in memory, the others are on disk
+            blocks = deep_size(self.store._cache, seen)
+            fragments = deep_size(self.store.offsets, seen) + deep_size(self.store.lengths, seen)
+        footprint = {
+            "blocks": len(self.hashes),
+            "chain_bytes": blocks,
+            "fragment_bytes": fragments,
+            "cached_fragments": len(self.fragments.cache) if self.store is None else 0,
+            "hash_bytes": deep_size(self.hashes, seen) + deep_size(self.heights, seen),
+            "index_bytes": deep_size(self.index.state(), seen),
+            "pending_bytes": deep_size(self.unconfirmed_transactions.transactions, seen),
+        }
+        footprint["bytes_per_block"] = (blocks + fragments) // max(len(self.hashes), 1)
+        if self.store is not None:
+            footprint["disk_bytes"] = self.store.end
+        return footprint
 
-    def create_genesis_block(self) -> None:
+    def create_genesis_block(self, timestamp: int = None) -> None:
         """
         A function to generate genesis block and appends it to
         the chain. The block has index 0, previous_hash as 0, and
         a valid hash.
+        :param timestamp: Nodes given the same timestamp share the genesis block.
         """
-        genesis_block = Block(0, [], int(time.time()), 0)
+        if timestamp is None:
+            timestamp = int(time.time())
+        genesis_block = Block(0, [], timestamp, 0, merkle_root=merkle_root([]))
         genesis_block.hash = genesis_block.compute_hash()
-        self.chain.append(genesis_block)
+        self.append(genesis_block)
+
+    def append(self, block: Block, fragment: str = None) -> None:
+        """
+        Append an already verified block to the chain.
+        :param fragment: Cached JSON of the block, if already known.
+        """
+        fragment = fragment or json.dumps(block.to_dict())
+        height = len(self.hashes)
+        # First, so that a malformed block leaves the chain unchanged
+        self.index.apply(block, height)
+        try:
+            if self.store is None:
+                self.chain.append(block)
+                self.fragments.append(block, fragment)
+            else:
+                self.store.append(block, fragment)
+        except Exception:
+            self.index.revert(block)
+            raise
+        self.heights[block.hash] = height
+        self.hashes.append(block.hash)
+        self.unconfirmed_transactions.remove(block.transactions)
+        if self.store is not None and len(self.hashes) % self.checkpoint_interval == 0:
+            self.checkpoint()
+        for listener in self.listeners:
+            listener("append", height, fragment)
+
+    def truncate(self, length: int) -> None:
+        """
+        Drop the blocks from height `length` on, their transactions go back
+        to the pending ones.
+        """
+        if length >= len(self.hashes):
+            return
+        for height in range(len(self.hashes) - 1, length - 1, -1):
+            block = self.chain[height]
+            self.index.revert(block)
+            del self.heights[self.hashes[height]]
+            for tx in block.transactions:
+                self.unconfirmed_transactions.add(tx)
+        del self.hashes[length:]
+        if self.store is None:
+            del self.chain[length:]
+            # Streams of /chain may still be reading the old view
+            self.fragments = self.fragments.truncated(length)
+        else:
+            self.store.truncate(length)
+            self.fragments = self.store.fragments
+        for listener in self.listeners:
+            listener("truncate", length)
+
+    def replace(self, length: int, blocks) -> None:
+        """
+        Keep the first `length` blocks and append `blocks`, which must be verified.
+        """
+        self.truncate(length)
+        for block in blocks:
+            self.append(block)
 
     @property
     def last_block(self) -> Block:
@@ -27,25 +242,26 @@ class Blockchain:
         """
         return self.chain[-1]
 
-    def proof_of_work(self, block: Block):
+    @timed(POW_SECONDS)
+    def proof_of_work(self, block: Block, cancel=None):
         """
         Function that tries different values of the nonce to get a hash
         that satisfies our difficulty criteria.
+        :param cancel: `threading.Event` aborting the search when set
+        :return: The hash, None if cancelled
         """
-        block.nonce = 0
-        computed_hash = block.compute_hash()
-        while not computed_hash.startswith('0' * Blockchain.difficulty):
-            block.nonce += 1
-            computed_hash = block.compute_hash()
-
+        computed_hash = Blockchain.miner.mine(block, Blockchain.difficulty, cancel)
+        POW_HASH_RATE.observe(Blockchain.miner.last_stats["hash_rate"])
         return computed_hash
 
     def is_vaild_proof(self, block: Block, block_hash: str):
         """
         Check if block_hash is valid hash of block and satisfies
-        the difficulty criteria.
+        the difficulty criteria, and that the block is within budget.
         """
-        return block_hash.startswith('0' * Blockchain.difficulty) and block_hash == block.compute_hash()
+        return block_hash.startswith('0' * Blockchain.difficulty) and \
+            block.fits(self.block_max_transactions, self.block_max_bytes) and \
+            block.has_valid_merkle_root() and block_hash == block.compute_hash()
 
     def add_block(self, block: Block, proof: str):
         """
@@ -61,34 +277,140 @@ class Blockchain:
         if not self.is_vaild_proof(block, proof):
             return False
         # block.hash = proof
-        self.chain.append(block)
+        self.append(block)
         return True
 
-    def add_new_transaction(self, transaction):
-        self.unconfirmed_transactions.append(transaction)
+    def receive_block(self, block: Block, proof: str):
+        """
+        Add a block from a peer, see `check_block` and `connect_block`.
+        :return: (status, blocks appended to our chain). The status is
+                 "added", "reorg", "side", "orphan", "known" or "invalid".
+        """
+        status = self.check_block(block, proof)
+        if status is not None:
+            return status, []
+        return self.connect_block(block)
 
-    def mine(self):
+    def check_block(self, block: Block, proof: str):
         """
-        This function serves as an interface to add the pending
-        transactions to the blockchain by adding them to the block
-        and figuring out proof of work.
+        The checks of a block from a peer that don't need its signatures:
+        the proof of work, the Merkle root, and the index when the parent
+        is known. Signatures are only worth verifying after these.
+        :return: "known" or "invalid", None if the block passed
         """
-        if not self.unconfirmed_transactions:
-            return False
+        if proof in self.heights or proof in self.pool:
+            return "known"
+        if not self.is_vaild_proof(block, proof):
+            return "invalid"
+        parent = self.pool.get(block.previous_hash)
+        if parent is not None:
+            parent_index = parent.index
+        else:
+            parent_index = self.heights.get(block.previous_hash)
+        if parent_index is not None and block.index != parent_index + 1:
+            return "invalid"
+        return None
 
-        last_block = self.last_block
+    def connect_block(self, block: Block):
+        """
+        Add a block that passed `check_block`, with authentic transactions.
+        It may not build on our tip: blocks of side branches and orphans are
+        kept in the pool, and we switch to a branch as soon as it is longer
+        than our chain, only the blocks after the fork are replaced.
+        :return: (status, blocks appended to our chain), as `receive_block`
+        """
+        if block.hash in self.heights or block.hash in self.pool:
+            return "known", []
+        self.pool.prune(len(self.hashes) - 1 - self.max_reorg_depth)
+        self.pool.add(block)
 
-        new_block = Block(
+        fork_hash, branch = self.pool.ancestors(block)
+        if fork_hash not in self.heights:
+            return "orphan", []
+        fork_height = self.heights[fork_hash]
+        if any(b.index != fork_height + 1 + i for i, b in enumerate(branch)):
+            self.pool.remove(block.hash)
+            return "invalid", []
+        for descendant in self.pool.longest_descendants(block.hash):
+            if descendant.index != fork_height + 1 + len(branch):
+                break
+            branch.append(descendant)
+        if fork_height + 1 + len(branch) <= len(self.hashes):
+            return "side", []
+
+        if self.replays(branch, fork_height):
+            self.pool.remove(block.hash)
+            return "invalid", []
+
+        status = "added" if fork_height == len(self.hashes) - 1 else "reorg"
+        dropped = self.chain[fork_height + 1:]
+        for new_block in branch:
+            self.pool.remove(new_block.hash)
+        self.replace(fork_height + 1, branch)
+        # The branch we left may become the longest again
+        for old_block in dropped:
+            self.pool.add(old_block)
+        return status, branch
+
+    def replays(self, blocks, fork_height) -> bool:
+        """
+        True if `blocks`, to follow our block at `fork_height`, repeat a
+        transaction of our chain up to that block or of one another.
+        """
+        seen = set()
+        for block in blocks:
+            for tx in block.transactions:
+                signature = tx['signature']
+                location = self.index.locate(signature)
+                if signature in seen or (location is not None and location[0] <= fork_height):
+                    return True
+                seen.add(signature)
+        return False
+
+    def knows_transaction(self, signature) -> bool:
+        """
+        True if the transaction is already mined on our chain or pending.
+        """
+        return self.index.locate(signature) is not None or \
+            signature in self.unconfirmed_transactions
+
+    def add_new_transaction(self, transaction) -> bool:
+        return self.unconfirmed_transactions.add(transaction)
+
+    def new_block(self):
+        """
+        The next block to mine on our tip, with the pending transactions
+        that fit in it.
+        :return: The block, None when nothing is pending
+        """
+        transactions = self.unconfirmed_transactions.select(
+            self.block_max_transactions, self.block_max_bytes)
+        if not transactions:
+            return None
+
+        last_block = self.last_block
+        return Block(
             index=last_block.index + 1,
-            transactions=self.unconfirmed_transactions,
+            transactions=transactions,
             timestamp=time.time(),
-            previous_hash=last_block.hash
+            previous_hash=last_block.hash,
+            merkle_root=merkle_root(transactions)
         )
 
-        proof = self.proof_of_work(new_block)
-        self.add_block(new_block, proof)
-        # Todo: Maybe lost data
-        self.unconfirmed_transactions = []
+    def mine(self, cancel=None):
+        """
+        This function serves as an interface to add the pending
+        transactions to the blockchain by adding them to the block
+        and figuring out proof of work.
+        """
+        new_block = self.new_block()
+        if new_block is None:
+            return False
+
+        proof = self.proof_of_work(new_block, cancel)
+        # Only the mined transactions leave the pool, see `append`
+        if proof is None or not self.add_block(new_block, proof):
+            return False
         return new_block.index
 
     @classmethod
@@ -97,19 +419,21 @@ class Blockchain:
         A helper method to check if the entire blockchain is valid.            
         """
         result = True
-        previous_hash = "0"
+        previous_hash = None
 
-        # Iterate through every block
+        # Iterate through every block, the genesis block is trusted
         for block in chain:
             block_hash = block.hash
-            # remove the hash field to recompute the hash again
-            # using `compute_hash` method.
-            delattr(block, "hash")
-
-            if not cls.is_valid_proof(block, block.hash) or \
-                    previous_hash != block.previous_hash:
-                result = False
-                break
+            if previous_hash is not None:
+                # `compute_hash` overwrites the hash field, restore it after
+                if not block_hash.startswith('0' * cls.difficulty) or \
+                        not block.fits(cls.block_max_transactions, cls.block_max_bytes) or \
+                        not block.has_valid_merkle_root() or \
+                        block_hash != block.compute_hash() or \
+                        previous_hash != block.previous_hash:
+                    result = False
+                    block.hash = block_hash
+                    break
 
             block.hash, previous_hash = block_hash, block_hash
 
@@ -0,0 +1,82 @@
+import re
+import sys
+
+# Lowercase hex strings are kept as raw bytes, half the size, and turned
+# back into the same string when unpacked
+_HEX = re.compile('(?:[0-9a-f]{2})+')
+
+# Key tuples shared by every transaction with the same fields in the same
+# order. Only the fields of a transaction are shared, keys sent by a peer
+# can't grow the table.
+_shapes = {}
+KNOWN_FIELDS = frozenset(('sender', 'receiver', 'amount', 'signature', 'timestamp', 'claim'))
+# Public keys are stored once however many transactions they appear in, up
+# to MAX_INTERNED_KEYS of them
+_keys = {}
+INTERNED_FIELDS = ('sender', 'receiver')
+MAX_INTERNED_KEYS = 100000
+
+
+def _pack_value(key, value):
+    if isinstance(value, str) and _HEX.fullmatch(value):
+        value = bytes.fromhex(value)
+        if key in INTERNED_FIELDS:
+            if len(_keys) < MAX_INTERNED_KEYS:
+                value = _keys.setdefault(value, value)
+            else:
+                value = _keys.get(value, value)
+    return value
+
+
+def _unpack_value(value):
+    return value.hex() if isinstance(value, bytes) else value
+
+
+def pack_transaction(tx):
+    """
+    Compact form of a transaction kept in memory: a tuple of the shared
+    tuple of its keys followed by its values, hex strings as bytes.
+    Anything but a dict is kept as is.
+    """
+    if not isinstance(tx, dict):
+        return tx
+    shape = tuple(tx)
+    if KNOWN_FIELDS.issuperset(shape):
+        shape = _shapes.setdefault(shape, tuple(sys.intern(key) for key in shape))
+    return (shape,) + tuple(_pack_value(key, value) for key, value in tx.items())
+
+
+def unpack_transaction(packed):
+    """
+    The transaction dict given to `pack_transaction`.
+    """
+    if not isinstance(packed, tuple):
+        return packed
+    return dict(zip(packed[0], map(_unpack_value, packed[1:])))
+
+
+def deep_size(obj, seen=None) -> int:
+    """
+    Bytes used by `obj` and everything it references, objects reachable
+    several times (interned keys, shared shapes) are counted once.
+    """
+    if seen is None:
+        seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif hasattr(obj, '__slots__'):
+            stack.extend(getattr(obj, name) for name in obj.__slots__ if hasattr(obj, name))
+        elif hasattr(obj, '__dict__'):
+            stack.append(obj.__dict__)
+    return size
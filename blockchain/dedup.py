@@ -0,0 +1,110 @@
+from collections import OrderedDict
+from hashlib import sha256
+import time
+
+
+class BloomFilter:
+    """
+    Two generation Bloom filter. When the current generation is full it
+    becomes the previous one and a new one starts, so old keys fade out.
+    """
+
+    def __init__(self, capacity=1000000, hashes=7, bits_per_key=10):
+        self.capacity = capacity
+        self.hashes = hashes
+        self.size = capacity * bits_per_key
+        self.current = bytearray(self.size // 8 + 1)
+        self.previous = bytearray(self.size // 8 + 1)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = sha256(key.encode()).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:16], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def __contains__(self, key):
+        positions = self._positions(key)
+        return all(self.current[p >> 3] & (1 << (p & 7)) for p in positions) or \
+            all(self.previous[p >> 3] & (1 << (p & 7)) for p in positions)
+
+    def add(self, key):
+        if self.count >= self.capacity:
+            self.previous, self.current = self.current, bytearray(len(self.current))
+            self.count = 0
+        for p in self._positions(key):
+            self.current[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+
+class DedupCache:
+    """
+    Set of recently seen keys with O(1) membership. Keys are dropped after
+    `ttl` seconds or when more than `maxsize` are stored, oldest first.
+    With a `bloom` filter, keys evicted from the exact set are still
+    recognized for much longer, but only as "maybe": the filter has false
+    positives, a key it recognizes has to be confirmed elsewhere.
+    """
+
+    def __init__(self, maxsize=100000, ttl=3600, bloom=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.bloom = bloom
+        self._seen = OrderedDict()
+        self.hits = 0
+        self.bloom_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _evict(self, now):
+        while self._seen:
+            key, expires = next(iter(self._seen.items()))
+            if expires > now and len(self._seen) <= self.maxsize:
+                break
+            self._seen.popitem(last=False)
+            self.evictions += 1
+
+    def __contains__(self, key):
+        expires = self._seen.get(key)
+        return expires is not None and expires > time.time()
+
+    def check(self, key):
+        """
+        Look `key` up, counting the hit.
+        :return: "seen" if it is in the set, "maybe" if only the Bloom filter
+                 recognizes it, None if it is new
+        """
+        if key in self:
+            self.hits += 1
+            return "seen"
+        if self.bloom is not None and key in self.bloom:
+            self.bloom_hits += 1
+            return "maybe"
+        return None
+
+    def add(self, key) -> bool:
+        """
+        Remember `key`.
+        :return: False if it was already seen, True otherwise
+        """
+        if key in self:
+            self.hits += 1
+            return False
+
+        now = time.time()
+        self.misses += 1
+        self._seen[key] = now + self.ttl
+        self._seen.move_to_end(key)
+        if self.bloom is not None:
+            self.bloom.add(key)
+        self._evict(now)
+        return True
+
+    def stats(self):
+        return {
+            "size": len(self._seen),
+            "hits": self.hits,
+            "bloom_hits": self.bloom_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,52 @@
+from collections import deque
+from threading import Condition
+import json
+
+
+class EventBus:
+    """
+    Recent changes of the node, for /events. Every event gets the next
+    sequence number, and the last `maxlen` of them are kept so that a
+    client can resume after the last one it received.
+    """
+
+    def __init__(self, maxlen=10000):
+        # (sequence number, type, JSON data)
+        self.events = deque(maxlen=maxlen)
+        self.last_id = 0
+        self._condition = Condition()
+
+    def publish(self, kind, data):
+        """
+        :param data: JSON of the event
+        """
+        with self._condition:
+            self.last_id += 1
+            self.events.append((self.last_id, kind, data))
+            self._condition.notify_all()
+
+    def publish_json(self, kind, value):
+        self.publish(kind, json.dumps(value))
+
+    def since(self, after):
+        """
+        :return: The events after sequence number `after`, None if some
+                 of them were already dropped
+        """
+        with self._condition:
+            if after > self.last_id:
+                return None
+            if self.events and after < self.events[0][0] - 1:
+                return None
+            if not self.events and after < self.last_id:
+                return None
+            return [event for event in self.events if event[0] > after]
+
+    def wait(self, after, timeout):
+        """
+        Block until there are events after `after`, or `timeout` seconds.
+        :return: like `since`
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self.last_id > after, timeout)
+            return self.since(after)
@@ -0,0 +1,85 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+import requests
+from requests.adapters import HTTPAdapter
+
+import wire
+
+
+class PeerFetcher:
+    """
+    Queries peers concurrently over a shared, kept-alive HTTP session.
+    Every request has a deadline so one slow peer can't stall the node.
+    """
+
+    def __init__(self, workers=10, timeout=(2, 5), binary=False):
+        """
+        :param workers: Number of peers queried at the same time.
+        :param timeout: (connect, read) timeout of a single request in seconds.
+        :param binary: Ask for the binary wire format, smaller than JSON but
+                       slower to decode.
+        """
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if binary:
+            # Peers answer in the binary wire format when they support it
+            self.session.headers['Accept'] = '{}, application/json;q=0.9'.format(wire.BINARY_TYPE)
+        else:
+            self.session.headers['Accept'] = 'application/json'
+        self.executor = ThreadPoolExecutor(workers)
+
+    def get_payload(self, url, params=None):
+        response = self.session.get(url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        if response.headers.get('Content-Type', '').startswith(wire.BINARY_TYPE):
+            return wire.loads(response.content)
+        return response.json()
+
+    def gather(self, peers, path, params=None):
+        """
+        GET `path` on every peer in parallel.
+        :return: {peer: json}, peers that failed or missed the deadline are left out
+        """
+        futures = {self.executor.submit(self.get_payload, peer + path, params): peer
+                   for peer in peers}
+        done, _ = wait(futures, timeout=sum(self.timeout))
+        results = {}
+        for future in done:
+            if future.exception() is None:
+                results[futures[future]] = future.result()
+        return results
+
+    def chain_lengths(self, peers):
+        """
+        :return: {peer: length of its chain}
+        """
+        return {peer: data['length']
+                for peer, data in self.gather(peers, 'chain/length').items()}
+
+    def blocks_since(self, peer, height, after=None):
+        """
+        Download every block of `peer` from `height`, or after the block with
+        hash `after`, following /blocks pages.
+        """
+        params = {'after': after} if after else {'since': height}
+        blocks = []
+        while True:
+            page = self.get_payload(peer + 'blocks', params)
+            blocks.extend(page['blocks'])
+            height = page['since'] + len(page['blocks'])
+            if not page['blocks'] or height >= page['length']:
+                return blocks
+            params = {'since': height}
+
+    def blocks_after(self, peer, block_hash):
+        """
+        :return: The blocks of `peer` after `block_hash`, None if it doesn't know that block
+        """
+        try:
+            return self.blocks_since(peer, 0, after=block_hash)
+        except requests.HTTPError as e:
+            if e.response.status_code == 404:
+                return None
+            raise
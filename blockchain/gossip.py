@@ -0,0 +1,149 @@
+from collections import deque
+from threading import Thread
+from urllib.parse import urlsplit
+import asyncio
+import json
+
+import wire
+
+
+class _PeerLink:
+    """
+    Outbound queue and persistent HTTP/1.1 connection to one peer. Pending
+    transactions are sent in batches, and when the peer falls behind the
+    oldest queued messages are dropped.
+    """
+
+    def __init__(self, gossip, peer):
+        url = urlsplit(peer)
+        self.gossip = gossip
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.path = url.path if url.path.endswith('/') else url.path + '/'
+        self.blocks = deque(maxlen=gossip.max_blocks)
+        self.transactions = deque(maxlen=gossip.max_transactions)
+        self.dropped = 0
+        self.wakeup = asyncio.Event()
+        self.reader = self.writer = None
+        self.task = gossip.loop.create_task(self.run())
+
+    def push(self, queue, payload):
+        if len(queue) == queue.maxlen:
+            self.dropped += 1
+        queue.append(payload)
+        self.wakeup.set()
+
+    @property
+    def depth(self):
+        return len(self.blocks) + len(self.transactions)
+
+    async def run(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while self.blocks or self.transactions:
+                if self.blocks:
+                    await self.send('add_block', self.blocks.popleft())
+                else:
+                    batch = [self.transactions.popleft() for _ in
+                             range(min(self.gossip.batch_size, len(self.transactions)))]
+                    await self.send('new_transactions', batch)
+
+    async def send(self, endpoint, payload):
+        """
+        POST a payload, the message is given up on any error.
+        """
+        if self.gossip.binary:
+            body, content_type = wire.dumps(payload), wire.BINARY_TYPE
+        else:
+            body, content_type = json.dumps(payload).encode(), 'application/json'
+        try:
+            await asyncio.wait_for(self._post(endpoint, body, content_type), self.gossip.timeout)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+            self.close()
+
+    async def _post(self, endpoint, body, content_type):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        request = ('POST {}{} HTTP/1.1\r\n'
+                   'Host: {}:{}\r\n'
+                   'Content-Type: {}\r\n'
+                   'Content-Length: {}\r\n'
+                   '\r\n').format(self.path, endpoint, self.host, self.port,
+                                  content_type, len(body))
+        self.writer.write(request.encode() + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionResetError('Connection closed by peer')
+        keep_alive = status_line.startswith(b'HTTP/1.1')
+        length = None
+        while True:
+            line = (await self.reader.readline()).strip()
+            if not line:
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            name, value = name.strip().lower(), value.strip().lower()
+            if name == 'content-length':
+                length = int(value)
+            elif name == 'connection':
+                keep_alive = value == 'keep-alive' or (keep_alive and value != 'close')
+        if length is None:
+            await self.reader.read()
+            keep_alive = False
+        else:
+            await self.reader.readexactly(length)
+        if not keep_alive:
+            self.close()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class Gossip:
+    """
+    Announces blocks and transactions to peers from an asyncio loop running
+    in its own thread, one queue and connection per peer.
+    """
+    # Messages queued per peer before the oldest are dropped
+    max_blocks = 16
+    max_transactions = 5000
+    # Transactions per /new_transactions message
+    batch_size = 100
+    # Seconds before a message to a peer is given up
+    timeout = 5
+
+    def __init__(self, binary=False):
+        """
+        :param binary: Send the binary wire format, smaller than JSON but
+                       slower to encode and decode.
+        """
+        self.binary = binary
+        self.loop = asyncio.new_event_loop()
+        self.links = {}
+        Thread(target=self.loop.run_forever, daemon=True).start()
+
+    def _link(self, peer):
+        link = self.links.get(peer)
+        if link is None:
+            link = self.links[peer] = _PeerLink(self, peer)
+        return link
+
+    def _push(self, peers, kind, payloads):
+        for peer in peers:
+            link = self._link(peer)
+            for payload in payloads:
+                link.push(link.blocks if kind == 'block' else link.transactions, payload)
+
+    def announce_block(self, peers, block_data):
+        self.loop.call_soon_threadsafe(self._push, list(peers), 'block', [block_data])
+
+    def announce_transactions(self, peers, transactions):
+        self.loop.call_soon_threadsafe(self._push, list(peers), 'transaction', list(transactions))
+
+    def stats(self):
+        return {peer: {"queued": link.depth, "dropped": link.dropped}
+                for peer, link in list(self.links.items())}
@@ -0,0 +1,101 @@
+class AddressIndex:
+    """
+    Balance and transaction list of every address, updated block by block
+    so a lookup doesn't depend on the length of the chain. Transactions are
+    kept as (block index, position) and read from the chain when listed.
+    """
+    # Balance of an address that never sent or received anything
+    initial_balance = 1000
+
+    def __init__(self, chain):
+        self.chain = chain
+        self.balances = {}
+        # Address -> [(block index, position in block)] in chain order
+        self.transactions = {}
+        # Signature -> (block index, position in block)
+        self.locations = {}
+
+    def apply(self, block, height):
+        """
+        Add the transactions of the block at `height`. Either all of them
+        are applied or, if one is malformed, none.
+        """
+        transactions = block.transactions
+        for position, tx in enumerate(transactions):
+            try:
+                self._apply(tx, (height, position))
+            except Exception:
+                self._revert(transactions[:position])
+                raise
+
+    def _apply(self, tx, ref):
+        """
+        Add one transaction, or leave the index unchanged if it is malformed.
+        """
+        amount = tx['amount']
+        if not isinstance(amount, (int, float)) or isinstance(amount, bool):
+            raise TypeError('amount must be a number')
+        self.locations[tx['signature']] = ref
+        try:
+            self._add(tx['sender'], -amount, ref)
+            if tx['receiver'] != tx['sender']:
+                try:
+                    self._add(tx['receiver'], amount, ref)
+                except Exception:
+                    self._add(tx['sender'], amount)
+                    raise
+        except Exception:
+            del self.locations[tx['signature']]
+            raise
+
+    def revert(self, block):
+        """
+        Undo `apply` for the last block of the chain.
+        """
+        self._revert(block.transactions)
+
+    def _revert(self, transactions):
+        for tx in reversed(transactions):
+            self.locations.pop(tx['signature'], None)
+            if tx['receiver'] != tx['sender']:
+                self._add(tx['receiver'], -tx['amount'])
+            self._add(tx['sender'], tx['amount'])
+
+    def _add(self, address, amount, ref=None):
+        self.balances[address] = self.balance(address) + amount
+        entries = self.transactions.setdefault(address, [])
+        if ref is not None:
+            entries.append(ref)
+        else:
+            entries.pop()
+
+    def balance(self, address):
+        return self.balances.get(address, self.initial_balance)
+
+    def history(self, address, offset=0, limit=50):
+        """
+        Transactions of `address`, newest first.
+        :return: (total, page of transactions)
+        """
+        entries = self.transactions.get(address, [])
+        end = max(len(entries) - offset, 0)
+        page = entries[max(end - limit, 0):end]
+        return len(entries), [dict(self.chain[height].transaction(position), index=height)
+                              for height, position in reversed(page)]
+
+    def locate(self, signature):
+        """
+        :return: (block index, position in block) of a mined transaction, or None
+        """
+        return self.locations.get(signature)
+
+    def state(self):
+        return {"balances": self.balances, "transactions": self.transactions,
+                "locations": self.locations}
+
+    def load(self, state):
+        self.balances = state["balances"]
+        self.transactions = {address: [tuple(ref) for ref in refs]
+                             for address, refs in state["transactions"].items()}
+        self.locations = {signature: tuple(ref)
+                          for signature, ref in state["locations"].items()}
@@ -0,0 +1,87 @@
+from collections import OrderedDict
+import json
+
+
+class Mempool:
+    """
+    Pending transactions, indexed by signature and by sender, in arrival
+    order which is also the order they are picked for a block. The pool is
+    bounded: when full, the oldest transactions are evicted, and a single
+    sender can't hold more than `max_per_sender` of them.
+    """
+
+    def __init__(self, max_count=50000, max_bytes=50 * 1024 * 1024, max_per_sender=1000):
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.max_per_sender = max_per_sender
+        # Signature -> (transaction, size in bytes)
+        self.transactions = OrderedDict()
+        self.by_sender = {}
+        self.size = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.transactions)
+
+    def __contains__(self, signature):
+        return signature in self.transactions
+
+    def __iter__(self):
+        for tx, _ in self.transactions.values():
+            yield tx
+
+    def add(self, tx) -> bool:
+        """
+        :return: False if the transaction is already pending or its sender
+                 has too many pending transactions
+        """
+        signature = tx['signature']
+        sender_txs = self.by_sender.setdefault(tx['sender'], set())
+        if signature in self.transactions or len(sender_txs) >= self.max_per_sender:
+            return False
+
+        size = len(json.dumps(tx))
+        self.transactions[signature] = (tx, size)
+        sender_txs.add(signature)
+        self.size += size
+        while len(self.transactions) > self.max_count or self.size > self.max_bytes:
+            self._pop(next(iter(self.transactions)))
+            self.evictions += 1
+        return signature in self.transactions
+
+    def _pop(self, signature):
+        tx, size = self.transactions.pop(signature)
+        self.size -= size
+        sender_txs = self.by_sender[tx['sender']]
+        sender_txs.discard(signature)
+        if not sender_txs:
+            del self.by_sender[tx['sender']]
+        return tx
+
+    def remove(self, transactions):
+        """
+        Drop the transactions that made it into a block.
+        """
+        for tx in transactions:
+            if tx.get('signature') in self.transactions:
+                self._pop(tx['signature'])
+
+    def select(self, max_count, max_bytes):
+        """
+        The oldest transactions that fit in a block of `max_count`
+        transactions and `max_bytes` bytes, left in the pool.
+        """
+        selected = []
+        total = 0
+        for tx, size in self.transactions.values():
+            if len(selected) >= max_count:
+                break
+            if total + size > max_bytes:
+                continue
+            selected.append(tx)
+            total += size
+        return selected
+
+    def sender(self, address):
+        return [self.transactions[signature][0]
+                for signature in self.by_sender.get(address, ())]
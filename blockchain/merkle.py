@@ -0,0 +1,59 @@
+from hashlib import sha256
+import json
+
+
+# Leaves and inner nodes are hashed with different prefixes, so that an
+# inner node can't pass for a transaction
+LEAF_PREFIX = b'\x00'
+NODE_PREFIX = b'\x01'
+
+
+def transaction_hash(transaction) -> str:
+    return sha256(LEAF_PREFIX + json.dumps(transaction, sort_keys=True).encode()).hexdigest()
+
+
+def _parent(left, right):
+    return sha256(NODE_PREFIX + bytes.fromhex(left) + bytes.fromhex(right)).hexdigest()
+
+
+def _levels(transactions):
+    """
+    Every level of the tree, leaves first. An odd node is carried up to the
+    next level as is: pairing it with itself would give [a, b, c] and
+    [a, b, c, c] the same root.
+    """
+    level = [transaction_hash(tx) for tx in transactions] or [sha256(b'').hexdigest()]
+    levels = [level]
+    while len(level) > 1:
+        parents = [_parent(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            parents.append(level[-1])
+        level = parents
+        levels.append(level)
+    return levels
+
+
+def merkle_root(transactions) -> str:
+    return _levels(transactions)[-1][0]
+
+
+def merkle_proof(transactions, position):
+    """
+    Inclusion proof of the transaction at `position`.
+    :return: [(sibling hash, True if the sibling is on the left)], leaves
+             first, levels where the node is carried up have no entry
+    """
+    proof = []
+    for level in _levels(transactions)[:-1]:
+        sibling = position ^ 1
+        if sibling < len(level):
+            proof.append((level[sibling], sibling < position))
+        position //= 2
+    return proof
+
+
+def verify_proof(tx_hash, proof, root) -> bool:
+    node = tx_hash
+    for sibling, left in proof:
+        node = _parent(sibling, node) if left else _parent(node, sibling)
+    return node == root
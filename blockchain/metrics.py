@@ -0,0 +1,179 @@
+"""
+Counters, gauges and histograms of the node, rendered in the Prometheus
+text format by /metrics, and sampled structured logging.
+"""
+from functools import wraps
+from threading import Lock
+import json
+import logging
+import os
+import random
+import time
+
+# Upper bounds in seconds of the default histogram buckets
+DEFAULT_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+
+# Fraction of the frequent events (one per transaction, per block...) logged
+LOG_SAMPLE = float(os.environ.get('LOG_SAMPLE', 0.01))
+
+logger = logging.getLogger('blockchain')
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for name, value in zip(names, values)) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if value not in (float('inf'), float('-inf')) else \
+        ('+Inf' if value > 0 else '-Inf')
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append('# HELP {} {}'.format(metric.name, metric.help))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self._lock = Lock()
+        registry.register(self)
+
+    def inc(self, amount=1, *label_values):
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self.values.items())
+        return ['{}{} {}'.format(self.name, _labels(self.labels, key), _number(value))
+                for key, value in values]
+
+
+class Gauge:
+    """
+    A value set by the code, or read from `function` when rendered. The
+    function returns a number, or {label values: number} for a labelled
+    gauge.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, help, labels=(), function=None, registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.function = function
+        self.values = {}
+        registry.register(self)
+
+    def set(self, value, *label_values):
+        self.values[label_values] = value
+
+    def samples(self):
+        values = self.values
+        if self.function is not None:
+            try:
+                values = self.function()
+            except Exception:
+                logger.exception('Gauge %s failed', self.name)
+                return []
+            if not isinstance(values, dict):
+                values = {(): values}
+        return ['{}{} {}'.format(self.name, _labels(self.labels, key if isinstance(key, tuple) else (key,)),
+                                 _number(value))
+                for key, value in list(values.items())]
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        # Label values -> [count per bucket, sum, count]
+        self.values = {}
+        self._lock = Lock()
+        registry.register(self)
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self.values.get(label_values)
+            if series is None:
+                series = self.values[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        lines = []
+        with self._lock:
+            values = [(key, list(counts), total, count) for key, (counts, total, count) in self.values.items()]
+        for key, counts, total, count in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _labels(self.labels + ('le',), key + (_number(bound),))
+                lines.append('{}_bucket{} {}'.format(self.name, labels, cumulative))
+            lines.append('{}_sum{} {}'.format(self.name, _labels(self.labels, key), _number(total)))
+            lines.append('{}_count{} {}'.format(self.name, _labels(self.labels, key), count))
+        return lines
+
+
+def timed(histogram, labels=None):
+    """
+    Decorator observing the duration of every call in `histogram`.
+    :param labels: Function of the call arguments returning the label values
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                label_values = labels(*args, **kwargs) if labels else ()
+                histogram.observe(time.perf_counter() - started, *label_values)
+        return wrapper
+    return decorator
+
+
+def log_event(event, sample=1.0, level=logging.INFO, **fields):
+    """
+    Log one JSON line for `event`, only a `sample` fraction of the calls
+    are logged.
+    """
+    if sample < 1.0 and random.random() >= sample:
+        return
+    if logger.isEnabledFor(level):
+        fields['event'] = event
+        fields['time'] = time.time()
+        logger.log(level, json.dumps(fields, default=str))
+
@@ -0,0 +1,131 @@
+from multiprocessing import Pool, Event
+import os
+import time
+
+# Number of nonces a worker tries between two checks of the stop flag
+CHECK_INTERVAL = 1000
+
+# Set by `_init_worker` inside every pool process
+_stop_event = None
+
+
+def _init_worker(stop_event):
+    global _stop_event
+    _stop_event = stop_event
+
+
+def _search(hasher, difficulty, start, step):
+    """
+    Worker loop. Tries nonces start, start + step, start + 2 * step, ...
+    until a hash with `difficulty` leading zeros is found or another
+    worker raises the stop flag.
+    :return: (nonce, hash, attempts), nonce and hash are None when stopped
+    """
+    target = '0' * difficulty
+    nonce = start
+    attempts = 0
+    while True:
+        computed_hash = hasher.hash(nonce)
+        attempts += 1
+        if computed_hash.startswith(target):
+            _stop_event.set()
+            return nonce, computed_hash, attempts
+        if attempts % CHECK_INTERVAL == 0 and _stop_event.is_set():
+            return None, None, attempts
+        nonce += step
+
+
+class SerialMiner:
+    """
+    Single core miner, walks the nonce space one value at a time.
+    """
+
+    def __init__(self):
+        self.last_stats = {"workers": 1, "attempts": 0,
+                           "elapsed": 0.0, "hash_rate": 0.0}
+
+    def _record(self, workers, attempts, started):
+        elapsed = time.time() - started
+        self.last_stats = {
+            "workers": workers,
+            "attempts": attempts,
+            "elapsed": elapsed,
+            "hash_rate": attempts / elapsed if elapsed else 0.0,
+        }
+
+    def mine(self, block, difficulty, cancel=None):
+        """
+        Find a nonce for `block`, set it on the block and return the hash.
+        :param cancel: `threading.Event` aborting the search when set
+        :return: The hash, None if cancelled
+        """
+        started = time.time()
+        target = '0' * difficulty
+        hasher = block.nonce_hasher()
+        nonce = 0
+        while not hasher.hash(nonce).startswith(target):
+            nonce += 1
+            if cancel is not None and nonce % CHECK_INTERVAL == 0 and cancel.is_set():
+                self._record(1, nonce + 1, started)
+                return None
+
+        block.nonce = nonce
+        self._record(1, nonce + 1, started)
+        return block.compute_hash()
+
+
+class ParallelMiner(SerialMiner):
+    """
+    Miner that splits the nonce space across a process pool. Worker `i` of
+    `n` tries the nonces i, i + n, i + 2n, ... and every worker stops as
+    soon as one of them finds a valid hash.
+    """
+
+    def __init__(self, workers=None):
+        super().__init__()
+        self.workers = workers or os.cpu_count() or 1
+        self._pool = None
+        self._stop_event = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._stop_event = Event()
+            self._pool = Pool(self.workers, _init_worker, (self._stop_event,))
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+
+    def mine(self, block, difficulty, cancel=None):
+        if self.workers == 1:
+            return super().mine(block, difficulty, cancel)
+
+        started = time.time()
+        hasher = block.nonce_hasher()
+
+        pool = self._get_pool()
+        self._stop_event.clear()
+        jobs = [pool.apply_async(_search, (hasher, difficulty, i, self.workers))
+                for i in range(self.workers)]
+
+        # Wait for every worker so the stop flag can be cleared safely next time
+        found = []
+        attempts = 0
+        for job in jobs:
+            while cancel is not None and not job.ready():
+                job.wait(0.05)
+                if cancel.is_set():
+                    self._stop_event.set()
+            nonce, computed_hash, tried = job.get()
+            attempts += tried
+            if nonce is not None:
+                found.append(nonce)
+
+        self._record(self.workers, attempts, started)
+        if not found:
+            return None
+        # Several workers may hit a valid hash in the same round, keep the lowest
+        block.nonce = min(found)
+        return block.compute_hash()
@@ -0,0 +1,140 @@
+from collections import OrderedDict
+from threading import Condition, Event, Thread
+import time
+
+from metrics import log_event
+
+
+class MiningService:
+    """
+    Mines in a background thread, one job at a time. A job mines the
+    pending transactions on our tip, and when the tip changes while the
+    proof of work is running (a peer's block was accepted, a longer chain
+    adopted) the attempt is aborted and the block rebuilt on the new tip.
+    """
+    # Finished jobs kept for /miner/jobs/<id>
+    history = 100
+
+    def __init__(self, blockchain, lock, on_mined=None, threshold=0):
+        """
+        :param lock: Lock held by whoever changes the chain
+        :param on_mined: Called with every block mined, outside of the lock
+        :param threshold: Start a job when this many transactions are
+                          pending, 0 to only mine on request
+        """
+        self.blockchain = blockchain
+        self.lock = lock
+        self.on_mined = on_mined
+        self.threshold = threshold
+        self.jobs = OrderedDict()
+        self.current = None
+        self._next_id = 1
+        # Set to abort the running proof of work
+        self._abort = Event()
+        self._condition = Condition()
+        Thread(target=self._run, daemon=True).start()
+
+    def start(self) -> dict:
+        """
+        Queue a job, or return the one not finished yet.
+        """
+        with self._condition:
+            if self.current is None:
+                self.current = {"id": self._next_id, "state": "queued", "created": time.time(),
+                                "finished": None, "index": None, "hash": None,
+                                "transactions": 0, "restarts": 0}
+                self._next_id += 1
+                self.jobs[self.current["id"]] = self.current
+                while len(self.jobs) > self.history:
+                    self.jobs.popitem(last=False)
+                self._condition.notify_all()
+            return dict(self.current)
+
+    def status(self, job_id) -> dict:
+        with self._condition:
+            job = self.jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def cancel(self, job_id=None) -> dict:
+        """
+        Cancel the current job, if `job_id` is it.
+        :return: The job, None if unknown
+        """
+        with self._condition:
+            job = self.current if job_id is None else self.jobs.get(job_id)
+            if job is not None and job is self.current:
+                self._finish(job, "cancelled")
+                self._abort.set()
+            return dict(job) if job is not None else None
+
+    def wait(self, job_id, timeout=None) -> dict:
+        """
+        Block until the job is finished or `timeout` seconds.
+        :return: The job, None if unknown or no longer kept
+        """
+        with self._condition:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            self._condition.wait_for(lambda: job["finished"] is not None, timeout)
+            return dict(job)
+
+    def tip_changed(self):
+        """
+        The chain changed under the running attempt, rebuild the block.
+        """
+        self._abort.set()
+
+    def transaction_added(self, pending):
+        if self.threshold and pending >= self.threshold:
+            self.start()
+
+    def _finish(self, job, state):
+        job["state"] = state
+        job["finished"] = time.time()
+        if job is self.current:
+            self.current = None
+        self._condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self.current is not None)
+                job = self.current
+                job["state"] = "running"
+            try:
+                self._mine(job)
+            except Exception as e:
+                log_event('mining_failed', error=repr(e))
+                with self._condition:
+                    if job["finished"] is None:
+                        self._finish(job, "failed")
+
+    def _mine(self, job):
+        while True:
+            with self.lock:
+                if job["finished"] is not None:
+                    return
+                block = self.blockchain.new_block()
+                if block is None:
+                    with self._condition:
+                        self._finish(job, "empty")
+                    return
+                # Cleared under the lock, a tip change can only come after
+                self._abort.clear()
+            job["transactions"] = block.transaction_count()
+
+            proof = self.blockchain.proof_of_work(block, self._abort)
+            # `cancel` finishes the job under the condition only, it is
+            # checked and the block added without releasing it
+            with self.lock, self._condition:
+                if job["finished"] is not None:
+                    return
+                if proof is None or not self.blockchain.add_block(block, proof):
+                    job["restarts"] += 1
+                    continue
+                job["index"], job["hash"] = block.index, block.hash
+                self._finish(job, "mined")
+            if self.on_mined is not None:
+                self.on_mined(block)
+            return
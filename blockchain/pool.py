@@ -0,0 +1,88 @@
+from collections import OrderedDict
+
+
+class BlockPool:
+    """
+    Valid blocks that are not on our chain: side branches, and orphans
+    whose parent we haven't seen yet. Indexed by hash and by parent hash,
+    bounded, the oldest blocks are evicted first.
+    """
+
+    def __init__(self, max_blocks=1000):
+        self.max_blocks = max_blocks
+        self.blocks = OrderedDict()
+        # Parent hash -> hashes of the pooled blocks built on it
+        self.children = {}
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __contains__(self, block_hash):
+        return block_hash in self.blocks
+
+    def get(self, block_hash):
+        return self.blocks.get(block_hash)
+
+    def add(self, block):
+        if block.hash in self.blocks:
+            return
+        self.blocks[block.hash] = block
+        self.children.setdefault(block.previous_hash, []).append(block.hash)
+        while len(self.blocks) > self.max_blocks:
+            self.remove(next(iter(self.blocks)))
+            self.evictions += 1
+
+    def remove(self, block_hash):
+        block = self.blocks.pop(block_hash, None)
+        if block is None:
+            return None
+        siblings = self.children[block.previous_hash]
+        siblings.remove(block_hash)
+        if not siblings:
+            del self.children[block.previous_hash]
+        return block
+
+    def ancestors(self, block):
+        """
+        Pooled blocks from `block` back to the first one whose parent isn't
+        pooled, that parent is where the branch joins a chain we know.
+        :return: (parent hash of the oldest block, blocks oldest first)
+        """
+        branch = [block]
+        while branch[-1].previous_hash in self.blocks:
+            branch.append(self.blocks[branch[-1].previous_hash])
+        branch.reverse()
+        return branch[0].previous_hash, branch
+
+    def longest_descendants(self, block_hash):
+        """
+        The longest branch of pooled blocks built on `block_hash`.
+        :return: blocks oldest first
+        """
+        best = []
+        # (hash, blocks from the start to it), depth first
+        stack = [(block_hash, [])]
+        while stack:
+            parent, path = stack.pop()
+            children = self.children.get(parent)
+            if not children:
+                if len(path) > len(best):
+                    best = path
+                continue
+            for child in children:
+                stack.append((child, path + [self.blocks[child]]))
+        return best
+
+    def prune(self, height):
+        """
+        Drop the blocks at `height` or below, too old to ever be switched to.
+        """
+        for block_hash in [h for h, block in self.blocks.items() if block.index <= height]:
+            self.remove(block_hash)
+
+    def roots(self):
+        """
+        Parent hashes the pooled branches are built on, outside of the pool.
+        """
+        return [parent for parent in self.children if parent not in self.blocks]
@@ -0,0 +1,129 @@
+import json
+from flask import Response, request
+
+from block import Block
+from stream import gzip_stream, json_array
+import wire
+
+# Responses of the read endpoints, served by the node (server.py) and by
+# its read replicas (replica.py). `blockchain` is the node's Blockchain or
+# a ChainReader, both have `chain`, `fragments`, `heights` and `last_block`.
+
+# Largest page returned by /blocks and /headers
+MAX_BLOCKS = 500
+MAX_HEADERS = 2000
+
+NDJSON_TYPE = 'application/x-ndjson'
+
+
+def wants_binary():
+    return request.accept_mimetypes.best_match(
+        ['application/json', wire.BINARY_TYPE]) == wire.BINARY_TYPE
+
+
+def binary_blocks_response(fields, key, blocks):
+    """
+    Stream `fields` and the `blocks` under `key`, encoding one block at a time.
+    """
+    return Response(wire.dumps_stream(fields, key, (block.to_dict() for block in blocks),
+                                      len(blocks)),
+                    mimetype=wire.BINARY_TYPE)
+
+
+def chain_response(blockchain):
+    """
+    Stream the cached JSON of every block. Clients polling an unchanged
+    chain get a 304 through the ETag, gzip is used when accepted. Every
+    representation (JSON, gzipped JSON, binary) has its own ETag.
+    """
+    fragments = blockchain.fragments
+    length = len(fragments)
+    binary = wants_binary()
+    gzip = not binary and request.accept_encodings['gzip'] > 0
+    etag = '{}-{}{}'.format(length, blockchain.last_block.hash,
+                            '-bin' if binary else '-gzip' if gzip else '')
+    vary = {'Vary': 'Accept, Accept-Encoding'}
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=dict(vary, ETag='"{}"'.format(etag)))
+
+    if binary:
+        response = binary_blocks_response({"length": length}, "chain",
+                                          blockchain.chain[:length])
+    else:
+        chunks = json_array('{{"length": {}, "chain": ['.format(length),
+                            fragments, ']}', length)
+        if gzip:
+            response = Response(gzip_stream(chunks), mimetype='application/json')
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = Response(chunks, mimetype='application/json')
+    response.headers.update(vary)
+    response.set_etag(etag)
+    return response
+
+
+def blocks_response(blockchain):
+    """
+    Range of blocks, either from height `since` or after the block whose
+    hash is `after`, at most `limit` of them.
+    """
+    limit = min(request.args.get('limit', MAX_BLOCKS, type=int), MAX_BLOCKS)
+    since = request.args.get('since', 0, type=int)
+    after = request.args.get('after')
+    if after is not None:
+        if after not in blockchain.heights:
+            return "Unknown block", 404
+        since = blockchain.heights[after] + 1
+
+    fragments = blockchain.fragments
+    since = max(since, 0)
+    if wants_binary():
+        return binary_blocks_response({"length": len(fragments), "since": since}, "blocks",
+                                      blockchain.chain[since:since + limit])
+    head = '{{"length": {}, "since": {}, "blocks": ['.format(len(fragments), since)
+    return Response(json_array(head, fragments[since:since + limit], ']}'),
+                    mimetype='application/json')
+
+
+def headers_response(blockchain):
+    """
+    Newline delimited JSON stream of block headers, from height `since` or
+    after the block whose hash is `after`, at most `limit` of them. The
+    first line gives the length of the chain.
+    """
+    limit = min(request.args.get('limit', MAX_HEADERS, type=int), MAX_HEADERS)
+    since = max(request.args.get('since', 0, type=int), 0)
+    after = request.args.get('after')
+    if after is not None:
+        if after not in blockchain.heights:
+            return "Unknown block", 404
+        since = blockchain.heights[after] + 1
+
+    chain = blockchain.chain
+    stop = min(since + limit, len(chain))
+
+    def generate():
+        yield json.dumps({"length": len(chain), "since": since}) + "\n"
+        for height in range(since, stop):
+            yield json.dumps(chain[height].light_header()) + "\n"
+
+    return Response(generate(), mimetype=NDJSON_TYPE)
+
+
+def chain_length_response(blockchain):
+    return json.dumps({"length": len(blockchain.chain),
+                       "hash": blockchain.last_block.hash})
+
+
+def block_response(blockchain, id):
+    if not 0 <= id < len(blockchain.fragments):
+        return "Unknown block", 404
+    return Response(blockchain.fragments[id], mimetype='application/json')
+
+
+def block_hash_response(blockchain, id):
+    if not 0 <= id < len(blockchain.chain):
+        return "Unknown block", 404
+    t_dict = blockchain.chain[id].to_dict()
+    t_dict.pop('hash', None)
+    return Block.compute_hash_from_dict(t_dict)
@@ -0,0 +1,168 @@
+"""
+Read replica of a node, serving the read endpoints from the node's block
+store so that reads scale across cores while the node keeps every write.
+
+    BLOCK_STORE=chain python server.py --port 5000
+    BLOCK_STORE=chain python replica.py --port 5001 --workers 4
+
+The node is the only writer of the store: blocks are added, mined and
+reorganized there, and the pending transactions stay in its memory, a copy
+is saved to the store for /pending_tx. Every worker process opens the store
+read-only and catches up with the node before each request. Put a proxy in
+front to send GET /chain, /blocks, /headers, /chain/length, /block/<id>,
+/block/<id>/hash and /pending_tx to the replicas and the rest to the node.
+"""
+from argparse import ArgumentParser
+from threading import Lock
+import json
+import os
+import socket
+
+from flask import Flask, request
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from reads import (block_hash_response, block_response, blocks_response,
+                   chain_length_response, chain_response, headers_response)
+from store import BlockStore
+
+
+class ChainReader:
+    """
+    Read-only view of the chain a node keeps in a `BlockStore`. The hashes
+    of the blocks are indexed once, a refresh only reads the blocks that
+    changed since the last one.
+    """
+
+    def __init__(self, directory):
+        self.store = BlockStore(directory, readonly=True)
+        self.chain = self.store.blocks
+        self.fragments = self.store.fragments
+        # Hash of every block, and hash -> height for range queries by hash
+        self.hashes = []
+        self.heights = {}
+        # Copy of the node's pending transactions, and its modification time
+        self.pending = []
+        self._pending_stamp = None
+        self._lock = Lock()
+        snapshot = self.store.load_snapshot()
+        if snapshot is not None and 'hashes' in snapshot:
+            self.hashes = snapshot['hashes']
+            self.heights = {block_hash: height for height, block_hash in enumerate(self.hashes)}
+        self._extend()
+        self.refresh()
+
+    @property
+    def last_block(self):
+        return self.chain[-1]
+
+    def _extend(self):
+        for height in range(len(self.hashes), len(self.store)):
+            block_hash = self.store.block(height).hash
+            self.hashes.append(block_hash)
+            self.heights[block_hash] = height
+
+    def _truncate(self, length):
+        for block_hash in self.hashes[length:]:
+            del self.heights[block_hash]
+        del self.hashes[length:]
+
+    def refresh(self):
+        """
+        Catch up with the node's writes to the store.
+        """
+        with self._lock:
+            changed = self.store.refresh()
+            if changed is not None:
+                changed = min(changed, len(self.hashes))
+                # Logs written before truncated records were kept may have
+                # a new block in the exact place of a dropped one, only its
+                # hash tells them apart
+                while changed > 0:
+                    self.store.forget(changed - 1)
+                    if self.store.block(changed - 1).hash == self.hashes[changed - 1]:
+                        break
+                    changed -= 1
+                self._truncate(changed)
+                self._extend()
+                # Streams of /chain keep the fragments they started with
+                self.fragments = self.store.fragments
+            pending = self.store.load_pending(self._pending_stamp)
+            if pending is not None:
+                self._pending_stamp, self.pending = pending
+
+    def sender(self, address):
+        return [tx for tx in self.pending if tx['sender'] == address]
+
+
+app = Flask(__name__)
+
+# The node's chain, BLOCK_STORE is the directory the node was started with
+reader = ChainReader(os.environ.get('BLOCK_STORE', 'chain'))
+
+
+@app.before_request
+def catch_up():
+    reader.refresh()
+
+
+@app.route('/chain', methods=['GET'])
+def get_chain():
+    return chain_response(reader)
+
+
+@app.route('/blocks', methods=['GET'])
+def get_blocks():
+    return blocks_response(reader)
+
+
+@app.route('/headers', methods=['GET'])
+def get_headers():
+    return headers_response(reader)
+
+
+@app.route('/chain/length', methods=['GET'])
+def get_chain_length():
+    return chain_length_response(reader)
+
+
+@app.route('/block/<int:id>')
+def get_block(id):
+    return block_response(reader, id)
+
+
+@app.route('/block/<int:id>/hash')
+def get_block_hash(id):
+    return block_hash_response(reader, id)
+
+
+@app.route('/pending_tx')
+def get_pending_tx():
+    sender = request.args.get('sender')
+    if sender is not None:
+        return json.dumps(reader.sender(sender))
+    return json.dumps(reader.pending)
+
+
+def serve(host, port, workers):
+    """
+    Accept on one socket from `workers` processes, each one a threaded server.
+    """
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(128)
+    for _ in range(workers - 1):
+        if os.fork() == 0:
+            break
+    make_server(host, port, app, threaded=True, fd=listener.fileno()).serve_forever()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('-p', '--port', type=int, default=5001)
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1,
+                        help='processes serving requests')
+    args = parser.parse_args()
+    WSGIRequestHandler.protocol_version = "HTTP/1.1"
+    serve(args.host, args.port, args.workers)
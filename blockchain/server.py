@@ -1,36 +1,181 @@
+from argparse import ArgumentParser
+import atexit
 import json
+import logging
+import os
 import requests
 import time
 import uuid
-from flask import Flask, request
-from multiprocessing.dummy import Pool
+from threading import Event, Lock, RLock, Thread
+from flask import Flask, Response, g, request
+from werkzeug.serving import WSGIRequestHandler
 
 from block import Block
 from blockchain import Blockchain
+from dedup import BloomFilter, DedupCache
+from events import EventBus
+from fetcher import PeerFetcher
+from gossip import Gossip
+from merkle import merkle_proof
+from metrics import LOG_SAMPLE, REGISTRY, Counter, Gauge, Histogram, log_event, timed
+from miner import ParallelMiner
+from mining import MiningService
+from reads import (MAX_BLOCKS, NDJSON_TYPE, block_hash_response, block_response, blocks_response,
+                   chain_length_response, chain_response, headers_response)
 from signature import Signature
+from store import BlockStore
+from stream import json_array
+from transaction import is_well_formed, verify_each, verify_transactions
+from validator import ChainValidator
+import wire
 
 # Initialize flask application
 app = Flask(__name__)
 
-# Initialize a blockchain object.
-blockchain = Blockchain()
-blockchain.create_genesis_block()
+# Mine with every core unless MINING_WORKERS says otherwise
+Blockchain.miner = ParallelMiner(int(os.environ.get('MINING_WORKERS', 0)) or None)
+
+# Initialize a blockchain object. With BLOCK_STORE set to a directory the
+# chain is kept on disk and reloaded from there on restart.
+BLOCK_STORE = os.environ.get('BLOCK_STORE')
+blockchain = Blockchain(BlockStore(BLOCK_STORE) if BLOCK_STORE else None)
+if not blockchain.chain:
+    # GENESIS_TIMESTAMP starts a network of nodes on the same genesis block
+    genesis_timestamp = os.environ.get('GENESIS_TIMESTAMP')
+    blockchain.create_genesis_block(int(genesis_timestamp) if genesis_timestamp else None)
+atexit.register(blockchain.checkpoint)
+
+# Held while the chain or the pending transactions change
+chain_lock = RLock()
+
+# Changes of the chain and new pending transactions, streamed by /events
+events = EventBus()
+
+
+def publish_chain_change(change, height, fragment=None):
+    if change == "append":
+        events.publish("new-block", '{{"height": {}, "block": {}}}'.format(height, fragment))
+    else:
+        events.publish_json("reorg", {"height": height})
+
+
+blockchain.listeners.append(publish_chain_change)
+
+# Read replicas (replica.py) serve /pending_tx from a copy of the pending
+# transactions kept in the store, saved at most every PENDING_SAVE_INTERVAL
+# seconds
+PENDING_SAVE_INTERVAL = 0.2
+pending_changed = Event()
+
+
+def save_pending():
+    while True:
+        pending_changed.wait()
+        pending_changed.clear()
+        with chain_lock:
+            transactions = list(blockchain.unconfirmed_transactions)
+        blockchain.store.save_pending(transactions)
+        time.sleep(PENDING_SAVE_INTERVAL)
+
+
+if blockchain.store is not None:
+    # Blocks move transactions in and out of the pending ones
+    blockchain.listeners.append(lambda *change: pending_changed.set())
+    pending_changed.set()
+    Thread(target=save_pending, daemon=True).start()
+
+# Remembers which blocks were already verified, see validator.py
+validator = ChainValidator()
+validator.reset(blockchain.hashes)
 
 # Contains the host addresses of other participating members of the network
 peers = set()
 
+# Held while the peers, the seen signatures or the node's keys change. The
+# chain and the pending transactions are guarded by chain_lock.
+state_lock = Lock()
+
+# Peers are asked for and sent the binary wire format with WIRE_BINARY=1.
+# It is smaller than JSON but slower to encode and decode.
+WIRE_BINARY = bool(os.environ.get('WIRE_BINARY'))
+
+# Pooled HTTP client used by consensus to query peers concurrently
+fetcher = PeerFetcher(binary=WIRE_BINARY)
+
 # Private key and Public key
-private_key = None
-public_key = None
+account = {"private_key": None, "public_key": None}
 
 # Client-ID
 client_uuid = uuid.uuid1().hex
 
-# Claim
-claimed = []
-
-# Request Pool
-pool = Pool(10)
+# Claim, signatures of the transactions already seen. Set DEDUP_BLOOM=1 to
+# also remember evicted signatures in a Bloom filter, whose hits are
+# confirmed against the chain and the pending transactions.
+claimed = DedupCache(maxsize=100000, ttl=3600,
+                     bloom=BloomFilter() if os.environ.get('DEDUP_BLOOM') else None)
+
+# Per-peer outbound queues and connections for announcements
+gossip = Gossip(binary=WIRE_BINARY)
+
+# Largest batch accepted by /new_transactions
+MAX_TRANSACTIONS = 10000
+
+# Longest wait of /mine?wait=1 for its job
+MINE_WAIT_TIMEOUT = 60
+
+# Seconds between two comments on an idle event stream, and longest wait
+# of a long-poll request to /events
+EVENTS_KEEP_ALIVE = 15
+EVENTS_POLL_TIMEOUT = 30
+
+# Exposed by /metrics
+REQUEST_SECONDS = Histogram('blockchain_http_request_seconds', 'Time to handle a request',
+                            labels=('endpoint',))
+CONSENSUS_SECONDS = Histogram('blockchain_consensus_seconds', 'Time of a consensus round')
+PEER_SYNC_SECONDS = Histogram('blockchain_peer_sync_seconds',
+                              'Time to download and verify the new blocks of a peer',
+                              labels=('peer',))
+TRANSACTIONS = Counter('blockchain_transactions_total',
+                       'Transactions received, by result', labels=('result',))
+BLOCKS_RECEIVED = Counter('blockchain_blocks_received_total',
+                          'Blocks announced by peers, by result', labels=('result',))
+Gauge('blockchain_chain_height', 'Number of blocks in the chain',
+      function=lambda: len(blockchain.hashes))
+Gauge('blockchain_mempool_transactions', 'Pending transactions',
+      function=lambda: len(blockchain.unconfirmed_transactions))
+Gauge('blockchain_mempool_bytes', 'Size of the pending transactions',
+      function=lambda: blockchain.unconfirmed_transactions.size)
+Gauge('blockchain_peers', 'Known peers', function=lambda: len(peers))
+Gauge('blockchain_pool_blocks', 'Side branch and orphan blocks kept off the chain',
+      function=lambda: len(blockchain.pool))
+Gauge('blockchain_gossip_queue_depth', 'Messages waiting to be sent to a peer', labels=('peer',),
+      function=lambda: {peer: stats["queued"] for peer, stats in gossip.stats().items()})
+Gauge('blockchain_gossip_dropped', 'Messages to a peer dropped from a full queue', labels=('peer',),
+      function=lambda: {peer: stats["dropped"] for peer, stats in gossip.stats().items()})
+Gauge('blockchain_miner_hash_rate', 'Hashes per second of the last proof of work',
+      function=lambda: Blockchain.miner.last_stats["hash_rate"])
+
+
+@app.before_request
+def start_timer():
+    g.started = time.perf_counter()
+
+
+@app.after_request
+def observe_request(response):
+    if 'started' in g:
+        REQUEST_SECONDS.observe(time.perf_counter() - g.started, request.endpoint or 'unknown')
+    return response
+
+
+def get_payload():
+    """
+    Body of the request, binary or JSON depending on its Content-Type.
+    :raises ValueError: if a binary body is malformed
+    """
+    if request.mimetype == wire.BINARY_TYPE:
+        return wire.loads(request.get_data())
+    return request.get_json()
 
 
 # Endpoint to add new peers to the network
@@ -41,15 +186,19 @@ def register_new_peers():
     if not node_address:
         return "Invalid data", 400
 
-    # Return exist peers
-    d_peers = json.loads(get_peers())
+    with state_lock:
+        # Return exist peers
+        d_peers = list(peers)
 
-    # Add the node to the peer list
-    peers.add(node_address)
+        # Add the node to the peer list
+        peers.add(node_address)
 
     # Return the blockchain to the newly registered node so that it can sync
-    d_chains = json.loads(get_chain())
-    return {**d_chains, **d_peers}
+    fragments = blockchain.fragments
+    head = '{{"length": {}, "chain": ['.format(len(fragments))
+    tail = '], "peers": {}}}'.format(json.dumps(d_peers))
+    return Response(json_array(head, fragments, tail, len(fragments)),
+                    mimetype='application/json')
 
 
 @app.route('/register_with', methods=['POST'])
@@ -71,60 +220,110 @@ def register_with_existing_node():
                              data=json.dumps(data), headers=headers)
 
     if response.status_code == 200:
-        global blockchain
-        global peers
         # update chain and the peers
         chain_dump = response.json()['chain']
-        blockchain = create_chain_from_dump(chain_dump)
-        peers.update(response.json()['peers'])
-        peers.add(node_address)
+        if not adopt_chain(*verify_chain_dump(chain_dump)):
+            return "The chain dump was not adopted", 409
+        with state_lock:
+            peers.update(response.json()['peers'])
+            peers.add(node_address)
         return "Registration successful", 200
     else:
         # if something goes wrong, pass it on to the API response
         return response.content, response.status_code
 
 
-def create_chain_from_dump(chain_dump):
-    _blockchain = Blockchain()
-    for idx, block_data in enumerate(chain_dump):
-        block = Block(block_data["index"],
-                      block_data["transactions"],
-                      block_data["timestamp"],
-                      block_data["previous_hash"],
-                      block_data['nonce'])
-        proof = block_data['hash']
-        if idx > 0:
-            added = _blockchain.add_block(block, proof)
-            if not added:
-                raise Exception("The chain dump is tampered!!")
-        else:  # the block is a genesis block, no verification needed
-            block.hash = proof
-            _blockchain.chain.append(block)
-    return _blockchain
+def verify_chain_dump(chain_dump):
+    """
+    Verify a chain dump. Blocks shared with the verified part of our chain
+    are not checked again, only the rest of the dump is.
+    :return: (height of the last block shared with our chain or -1, blocks after it)
+    """
+    shared = validator.fork_point(chain_dump)
+    if shared:
+        return shared - 1, verify_blocks(blockchain.hashes[shared - 1], chain_dump[shared:])
+
+    # the block is a genesis block, no verification needed
+    genesis = Block.from_dict(chain_dump[0])
+    return -1, [genesis] + verify_blocks(genesis.hash, chain_dump[1:])
+
+
+def verify_blocks(previous_hash, blocks_dump):
+    """
+    Verify blocks following the block whose hash is `previous_hash`.
+    :return: The blocks
+    """
+    if not validator.verify(blocks_dump, previous_hash, Blockchain.difficulty,
+                            Blockchain.block_max_transactions, Blockchain.block_max_bytes):
+        raise Exception("The chain dump is tampered!!")
+    transactions = [tx for block_data in blocks_dump
+                    for tx in block_data['transactions']]
+    if not verify_transactions(transactions):
+        raise Exception("The chain dump has unauthentic transactions!!")
+    return [Block.from_dict(block_data) for block_data in blocks_dump]
+
+
+def adopt_chain(height, blocks):
+    """
+    Replace our blocks after `height` with verified `blocks`, if they still
+    make a longer chain: ours may have changed while they were downloaded
+    and verified.
+    :return: False if the blocks were dropped
+    """
+    with chain_lock:
+        if height >= len(blockchain.hashes) or \
+                (height >= 0 and blocks and blocks[0].previous_hash != blockchain.hashes[height]):
+            return False
+        if height + 1 + len(blocks) <= len(blockchain.hashes):
+            return False
+        if blockchain.replays(blocks, height):
+            return False
+        blockchain.replace(height + 1, blocks)
+        validator.reset(blockchain.hashes)
+        mining.tip_changed()
+    return True
+
+
+@timed(PEER_SYNC_SECONDS, labels=lambda node: (node,))
+def fetch_new_blocks(node):
+    """
+    Download the blocks of `node` that we don't have. Asks for the blocks
+    after our tip, then after blocks further and further back until the
+    peer knows one of them.
+    :return: (height of the common block or -1, verified blocks after it)
+    """
+    height, step = len(blockchain.hashes) - 1, 1
+    while height >= 0:
+        blocks = fetcher.blocks_after(node, blockchain.hashes[height])
+        if blocks is not None:
+            return height, verify_blocks(blockchain.hashes[height], blocks)
+        height, step = height - step, step * 2
+    return verify_chain_dump(fetcher.blocks_since(node, 0))
 
 
+@timed(CONSENSUS_SECONDS)
 def consensus():
     """
     Our simple consensus algorithm. If a longer valid chain is
     found, our chain is replaced with it.
     """
-    global blockchain
-
-    longest_chain = None
     current_len = len(blockchain.chain)
 
-    for node in peers:
-        response = requests.get('{}chain'.format(node))
-        length = response.json()['length']
-        chain = response.json()['chain']
-        if length > current_len and blockchain.check_chain_validity(chain):
-            # Longer valid chain found!
-            current_len = length
-            longest_chain = chain
-
-    if longest_chain:
-        blockchain = longest_chain
-        return True
+    # Ask every peer for its length first, then download only the best chains
+    lengths = fetcher.chain_lengths(known_peers())
+    candidates = sorted((node for node in lengths if lengths[node] > current_len),
+                        key=lengths.get, reverse=True)
+
+    for node in candidates:
+        try:
+            height, blocks = fetch_new_blocks(node)
+        except Exception:
+            continue
+        if height + 1 + len(blocks) <= current_len:
+            continue
+        # Longer valid chain found!
+        if adopt_chain(height, blocks):
+            return True
 
     return False
 
@@ -134,134 +333,454 @@ def consensus():
 # and then adds it to the chain.
 @app.route('/add_block', methods=['POST'])
 def verify_and_add_block():
-    block_data = request.get_json()
-    print(block_data)
-    block = Block(block_data["index"],
-                  block_data["transactions"],
-                  block_data["timestamp"],
-                  block_data["previous_hash"],
-                  block_data["nonce"])
-
+    try:
+        block_data = get_payload()
+        block = Block.from_dict(block_data)
+    except (ValueError, KeyError, TypeError):
+        BLOCKS_RECEIVED.inc(1, 'invalid')
+        return "Bad Request - Invalid block data", 400
+    log_event('block_received', sample=LOG_SAMPLE, index=block.index, hash=block_data.get('hash'),
+              transactions=block.transaction_count())
+    # Relayed blocks come back from several peers, don't verify them again,
+    # and the signatures are only verified once the cheap checks passed
     proof = block_data['hash']
-    added = blockchain.add_block(block, proof)
-
-    if not added:
+    with chain_lock:
+        status = blockchain.check_block(block, proof)
+    if status == 'known':
+        BLOCKS_RECEIVED.inc(1, status)
+        return "Known block", 208
+    if status == 'invalid':
+        BLOCKS_RECEIVED.inc(1, status)
         return "The block was discarded by the node", 400
-
+    if not verify_transactions(block.transactions):
+        BLOCKS_RECEIVED.inc(1, 'unauthentic')
+        return "The block has unauthentic transactions", 400
+
+    with chain_lock:
+        status, appended = blockchain.connect_block(block)
+        if status == 'reorg':
+            validator.reset(blockchain.hashes)
+        elif status == 'added':
+            for new_block in appended:
+                validator.mark(new_block)
+        if appended:
+            # Stop mining on the old tip
+            mining.tip_changed()
+    BLOCKS_RECEIVED.inc(1, status)
+
+    if status == 'invalid':
+        return "The block was discarded by the node", 400
+    if status == 'known':
+        return "Known block", 208
+    if status in ('side', 'orphan'):
+        log_event('block_pooled', sample=LOG_SAMPLE, status=status, index=block.index, hash=block.hash)
+        return "Block kept off the chain ({})".format(status), 202
+
+    log_event('block_added', status=status, index=block.index, hash=block.hash,
+              appended=len(appended))
+    # Relay the blocks our chain switched to, peers that know them answer 208
+    for new_block in appended:
+        announce_new_block(new_block)
     return "Block added to the chain", 201
 
 
+def known_peers():
+    with state_lock:
+        return list(peers)
+
+
 def announce_new_block(block):
     """
     A function to announce to the network once a block has been mined.
     Other blocks can simply verify the proof of work and add it to their
     respective chains.
     """
-    headers = {'Content-Type': "application/json"}
-    for peer in peers:
-        url = "{}add_block".format(peer)
-        pool.apply_async(requests.post,
-                         (url, json.dumps(block.__dict__, sort_keys=True)),
-                         dict(headers=headers, timeout=(5, 0.0000000001)))
+    gossip.announce_block(known_peers(), block.to_dict())
 
 
-def announce_new_transaction(transaction):
+def announce_new_transactions(transactions):
     """
-    A function to announce to the network once a transaction is come.
+    A function to announce to the network once transactions are come,
+    they are sent to each peer in batches.
     """
-    headers = {'Content-Type': "application/json"}
+    gossip.announce_transactions(known_peers(), transactions)
 
-    for peer in peers:
-        url = "{}new_transaction".format(peer)
-        pool.apply_async(requests.post,
-                         (url, json.dumps(transaction)),
-                         dict(headers=headers, timeout=(5, 0.0000000001)))
+
+def admit_transactions(items):
+    """
+    Check transactions received from a wallet or a peer and add them to
+    the pending ones. Each step runs over the whole batch: duplicates are
+    dropped, the signatures of the rest are verified as one batch, and the
+    authentic ones enter the mempool under a single lock.
+    :return: [(message, status code)], 201 when it should be announced
+    """
+    results = [None] * len(items)
+    candidates = []
+    for i, data in enumerate(items):
+        if not is_well_formed(data):
+            TRANSACTIONS.inc(1, 'invalid')
+            results[i] = "Bad Request - Invalid transaction data", 400
+            continue
+
+        # Check exist, the claim list holds the nodes the payload went through.
+        # Signatures are claimed once they made it into the mempool, see below
+        claim = data.get('claim') or []
+        with state_lock:
+            seen = client_uuid in claim or claimed.check(data['signature'])
+        if seen == 'maybe':
+            # Possibly a false positive of the Bloom filter
+            with chain_lock:
+                seen = blockchain.knows_transaction(data['signature'])
+        if seen:
+            TRANSACTIONS.inc(1, 'duplicate')
+            results[i] = 'Exist', 208
+            continue
+        data['claim'] = claim + [client_uuid]
+        candidates.append(i)
+
+    # Check authentic
+    authentic = []
+    for i, ok in zip(candidates, verify_each([items[i] for i in candidates])):
+        if ok:
+            authentic.append(i)
+        else:
+            TRANSACTIONS.inc(1, 'unauthentic')
+            results[i] = "The transaction is not authentic.", 401
+
+    now = time.time()
+    added = []
+    with chain_lock:
+        for i in authentic:
+            # The dedup cache forgets old signatures, the chain doesn't
+            if blockchain.knows_transaction(items[i]['signature']):
+                results[i] = 'Exist', 208
+                continue
+            transaction = dict(items[i], timestamp=now)
+            transaction.pop('claim', None)
+            if blockchain.add_new_transaction(transaction):
+                results[i] = "Success", 201
+                added.append(transaction)
+            else:
+                # Not claimed, the sender may retry later
+                results[i] = "Too many pending transactions", 429
+        pending = len(blockchain.unconfirmed_transactions)
+    with state_lock:
+        for transaction in added:
+            claimed.add(transaction['signature'])
+    if added:
+        events.publish_json("new-transaction", {"transactions": added})
+        pending_changed.set()
+
+    for i in authentic:
+        if results[i][1] == 201:
+            TRANSACTIONS.inc(1, 'accepted')
+            log_event('transaction_accepted', sample=LOG_SAMPLE, signature=items[i]['signature'],
+                      sender=items[i]['sender'], amount=items[i]['amount'])
+        elif results[i][1] == 208:
+            TRANSACTIONS.inc(1, 'duplicate')
+        else:
+            TRANSACTIONS.inc(1, 'rejected')
+    if authentic:
+        mining.transaction_added(pending)
+    return results
 
 
 @app.route("/new_transaction", methods=['POST'])
 def new_transaction():
-    data = request.get_json()
-    required_fields = ['sender', 'receiver', 'amount', 'signature']
-
-    if not all(k in data for k in required_fields):
+    try:
+        data = get_payload()
+    except ValueError:
         return "Bad Request - Invalid transaction data", 400
 
-    # Check exist
-    if data['signature'] in claimed:
-        return 'Exist', 208
-    else:
-        claimed.append(data['signature'])
+    [(message, status)] = admit_transactions([data])
+    if status == 201:
+        # Announce
+        announce_new_transactions([data])
+    return message, status
 
-    if 'claim' in data:
-        if client_uuid in data['claim']:
-            return 'Exist', 208
-        else:
-            data['claim'].append(client_uuid)
-    else:
-        data['claim'] = [client_uuid]
 
-    # Check authentic
-    verify = dict(data)
-    signature = verify['signature']
-    verify.pop('signature', None)
-    verify.pop('claim', None)
+@app.route("/new_transactions", methods=['POST'])
+def new_transactions():
+    """
+    Batch of transactions, as a JSON or binary list, or as NDJSON with one
+    transaction per line. Answers the result of every transaction in the
+    same format, the accepted ones are announced to peers at once.
+    """
+    ndjson = request.mimetype == NDJSON_TYPE
     try:
-        Signature.verify(verify['sender'], signature, json.dumps(verify, sort_keys=True))
-        print("The transaction is authentic.")
+        if ndjson:
+            items = [json.loads(line) for line in request.stream if line.strip()]
+        else:
+            items = get_payload()
     except ValueError:
-        return "The transaction is not authentic.", 401
-
-    # Announce
-    announce_new_transaction(data)
+        return "Bad Request - Invalid transaction data", 400
+    if not isinstance(items, list):
+        return "Bad Request - Expected a list of transactions", 400
+    if len(items) > MAX_TRANSACTIONS:
+        return "Too many transactions, at most {} per request".format(MAX_TRANSACTIONS), 413
 
-    data['timestamp'] = time.time()
-    data.pop('claim', None)
+    results = admit_transactions(items)
+    announce_new_transactions([data for data, (_, status) in zip(items, results) if status == 201])
+    results = [{"status": status, "message": message} for message, status in results]
+    if ndjson:
+        return Response(''.join(json.dumps(result) + '\n' for result in results),
+                        mimetype=NDJSON_TYPE)
+    return json.dumps(results), 200
 
-    blockchain.add_new_transaction(data)
 
-    return "Success", 201
+def replay_events(since, after):
+    """
+    Events to send before the live ones: the blocks from height `since`,
+    or the buffered events after sequence number `after`.
+    :return: (sequence number the live events follow, [(id, type, data)])
+    """
+    with chain_lock:
+        cursor = events.last_id
+        length = len(blockchain.hashes)
+        fragments = blockchain.fragments
+    if after is not None:
+        backlog = events.since(after)
+        if backlog is not None:
+            return backlog[-1][0] if backlog else after, backlog
+        if since is None:
+            # Too far behind, the client has to fetch the chain again
+            return cursor, [(cursor, "reset", json.dumps({"length": length}))]
+    if since is None:
+        return cursor, []
+    return cursor, [(cursor, "new-block", '{{"height": {}, "block": {}}}'.format(height, fragments[height]))
+                    for height in range(max(since, 0), length)]
+
+
+@app.route('/events', methods=['GET'])
+def get_events():
+    """
+    Server-sent events: "new-block" with the height and the block,
+    "new-transaction" with the new pending transactions, and "reorg" with
+    the height from which blocks were dropped. A client resumes after the
+    Last-Event-ID header (or ?after=), or with ?since=<height> to first get
+    the blocks from that height. With ?poll=1 the events are answered as
+    JSON once there are some, or after ?timeout= seconds, with the id to
+    poll after next.
+    """
+    after = request.headers.get('Last-Event-ID', request.args.get('after'))
+    try:
+        after = int(after) if after is not None else None
+    except ValueError:
+        return "Bad Request - Invalid event id", 400
+    since = request.args.get('since', type=int)
+    cursor, backlog = replay_events(since, after)
+
+    if request.args.get('poll', type=int):
+        timeout = min(max(request.args.get('timeout', EVENTS_POLL_TIMEOUT, type=float), 0),
+                      EVENTS_POLL_TIMEOUT)
+        if not backlog:
+            backlog = events.wait(cursor, timeout) or []
+        if backlog:
+            cursor = backlog[-1][0]
+        return Response('{{"last_id": {}, "events": ['.format(cursor)
+                        + ', '.join('{{"id": {}, "type": "{}", "data": {}}}'.format(*event)
+                                    for event in backlog) + ']}',
+                        mimetype='application/json')
+
+    def generate():
+        last = cursor
+        # Without a backlog, the headers would only go out with the first
+        # event, and the client wouldn't know where to resume
+        if not backlog:
+            yield 'id: {}\n\n'.format(cursor)
+        for event in backlog:
+            yield 'id: {}\nevent: {}\ndata: {}\n\n'.format(*event)
+        while True:
+            new_events = events.wait(last, EVENTS_KEEP_ALIVE)
+            if new_events is None:
+                yield 'event: reset\ndata: {{"length": {}}}\n\n'.format(len(blockchain.hashes))
+                return
+            if not new_events:
+                yield ': keep-alive\n\n'
+                continue
+            for event in new_events:
+                yield 'id: {}\nevent: {}\ndata: {}\n\n'.format(*event)
+            last = new_events[-1][0]
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 
 @app.route('/chain', methods=['GET'])
 def get_chain():
-    chain_data = []
-    for block in blockchain.chain:
-        chain_data.append(block.__dict__)
-    return json.dumps({"length": len(chain_data),
-                       "chain": chain_data})
+    return chain_response(blockchain)
+
+
+@app.route('/blocks', methods=['GET'])
+def get_blocks():
+    return blocks_response(blockchain)
+
+
+@app.route('/headers', methods=['GET'])
+def get_headers():
+    return headers_response(blockchain)
+
+
+@app.route('/tx/<signature>/proof', methods=['GET'])
+def get_transaction_proof(signature):
+    """
+    Merkle inclusion proof of a mined transaction.
+    """
+    with chain_lock:
+        location = blockchain.index.locate(signature)
+        if location is None:
+            return "Unknown transaction", 404
+        height, position = location
+        block = blockchain.chain[height]
+    if block.merkle_root is None:
+        return "The block has no Merkle root", 404
+    transactions = block.transactions
+    return json.dumps({"transaction": transactions[position],
+                       "height": height,
+                       "position": position,
+                       "header": block.light_header(),
+                       "proof": merkle_proof(transactions, position)})
+
+
+@app.route('/address/<pubkey>/balance', methods=['GET'])
+def get_address_balance(pubkey):
+    return json.dumps({"address": pubkey,
+                       "balance": blockchain.index.balance(pubkey)})
+
+
+@app.route('/address/<pubkey>/txs', methods=['GET'])
+def get_address_transactions(pubkey):
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', 50, type=int), 0), MAX_BLOCKS)
+    with chain_lock:
+        total, transactions = blockchain.index.history(pubkey, offset, limit)
+    return json.dumps({"address": pubkey,
+                       "total": total,
+                       "offset": offset,
+                       "transactions": transactions})
+
+
+@app.route('/chain/length', methods=['GET'])
+def get_chain_length():
+    return chain_length_response(blockchain)
+
+
+def block_mined(block):
+    """
+    Called by the mining service with every block it added to our chain.
+    """
+    with chain_lock:
+        validator.mark(block)
+    log_event('block_mined', index=block.index, hash=block.hash, **Blockchain.miner.last_stats)
+    # Making sure we have the longest chain before announcing to the network
+    consensus()
+    if blockchain.last_block.hash == block.hash:
+        # announce the recently mined block to the network
+        announce_new_block(block)
+
+
+# Background miner. With MINE_THRESHOLD set, mining starts by itself when
+# that many transactions are pending.
+mining = MiningService(blockchain, chain_lock, block_mined,
+                       int(os.environ.get('MINE_THRESHOLD', 0)))
 
 
 @app.route('/mine', methods=['GET'])
 def mine_unconfirmed_transactions():
-    result = blockchain.mine()
-    if not result:
+    """
+    Start mining in the background. With ?wait=1 the response is only sent
+    once the job is finished.
+    """
+    job = mining.start()
+    if not request.args.get('wait', type=int):
+        return json.dumps(job), 202
+    job = mining.wait(job["id"], MINE_WAIT_TIMEOUT)
+    if job is None:
+        return "Unknown job", 404
+    if job["finished"] is None:
+        # Still running, the job can be followed at /miner/jobs/<id>
+        return json.dumps(job), 202
+    if job["state"] == "mined":
+        return "Block #{} is mined.".format(job["index"])
+    if job["state"] == "empty":
         return "No transactions to mine"
-    else:
-        # Making sure we have the longest chain before announcing to the network
-        chain_length = len(blockchain.chain)
-        consensus()
-        if chain_length == len(blockchain.chain):
-            # announce the recently mined block to the network
-            announce_new_block(blockchain.last_block)
-        return "Block #{} is mined.".format(blockchain.last_block.index)
+    return "Mining job {}".format(job["state"]), 409
+
+
+@app.route('/miner')
+def get_miner_stats():
+    return json.dumps(dict(Blockchain.miner.last_stats, job=mining.current))
+
+
+@app.route('/miner/jobs', methods=['POST'])
+def start_mining_job():
+    return json.dumps(mining.start()), 202
+
+
+@app.route('/miner/jobs/<int:job_id>', methods=['GET'])
+def get_mining_job(job_id):
+    job = mining.status(job_id)
+    if job is None:
+        return "Unknown job", 404
+    return json.dumps(job)
+
+
+@app.route('/miner/jobs/<int:job_id>', methods=['DELETE'])
+def cancel_mining_job(job_id):
+    job = mining.cancel(job_id)
+    if job is None:
+        return "Unknown job", 404
+    return json.dumps(job)
 
 
 @app.route('/pending_tx')
 def get_pending_tx():
-    return json.dumps(blockchain.unconfirmed_transactions)
+    sender = request.args.get('sender')
+    with chain_lock:
+        if sender is not None:
+            transactions = blockchain.unconfirmed_transactions.sender(sender)
+        else:
+            transactions = list(blockchain.unconfirmed_transactions)
+    return json.dumps(transactions)
+
+
+@app.route('/block/<int:id>')
+def get_block(id):
+    return block_response(blockchain, id)
 
 
 @app.route('/block/<int:id>/hash')
 def get_block_hash(id):
-    t_dict = dict(blockchain.chain[id].__dict__)
-    t_dict.pop('hash', None)
-    return Block.compute_hash_from_dict(t_dict)
+    return block_hash_response(blockchain, id)
+
+
+@app.route('/metrics')
+def get_metrics():
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/memory')
+def get_memory_footprint():
+    with chain_lock:
+        footprint = blockchain.memory_footprint()
+    return json.dumps(footprint)
+
+
+@app.route('/gossip')
+def get_gossip_stats():
+    return json.dumps(gossip.stats())
+
+
+@app.route('/dedup')
+def get_dedup_stats():
+    with state_lock:
+        return json.dumps(claimed.stats())
 
 
 @app.route('/peers')
 def get_peers():
     return json.dumps({
-        "peers": list(peers)
+        "peers": known_peers()
     })
 
 
@@ -275,13 +794,12 @@ def generate_key():
 
 
 def save_private_key(prv_key):
-    global private_key
-    global public_key
-    private_key = prv_key
-    public_key = Signature.get_public_key(prv_key)
-    with open('private.key', 'w') as f:
-        f.write(prv_key)
-        f.close()
+    with state_lock:
+        account["private_key"] = prv_key
+        account["public_key"] = Signature.get_public_key(prv_key)
+        with open('private.key', 'w') as f:
+            f.write(prv_key)
+            f.close()
 
 
 @app.route('/create_account')
@@ -304,14 +822,24 @@ def add_private_key():
     if not all(k in data for k in required_fields):
         return "Bad Request - Invalid transaction data", 400
 
-    save_private_key(private_key)
+    save_private_key(data['private_key'])
 
     return 'Success', 200
 
 @app.route('/key')
 def key():
-    return private_key
+    return account["private_key"]
 
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    parser = ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('-p', '--port', type=int, default=5000)
+    parser.add_argument('--no-debug', dest='debug', action='store_false',
+                        help='no debugger nor reloader, e.g. for the simulator')
+    args = parser.parse_args()
+    # Keep-alive for the persistent gossip connections of the peers
+    WSGIRequestHandler.protocol_version = "HTTP/1.1"
+    # JSON events of metrics.log_event, one per line
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'), format='%(message)s')
+    app.run(host=args.host, port=args.port, debug=args.debug)
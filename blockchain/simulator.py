@@ -0,0 +1,430 @@
+"""
+Runs a network of nodes on loopback and measures it under load.
+
+    python simulator.py --nodes 5 --topology ring --latency 0.05 --drop 0.01
+
+Every node is a server.py process. Peers reach a node only through a proxy
+that delays, drops and counts its traffic, the simulator itself talks to
+the nodes directly. A signing workload sends transactions to random nodes,
+then nodes mine concurrently, and the results are written as one JSON
+document: transaction propagation latency, fork rate, convergence time
+and bandwidth per node.
+"""
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread
+import asyncio
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+import requests
+
+from signature import Signature
+from transaction import signed_message
+
+
+class LinkProxy:
+    """
+    TCP proxy in front of a node. Every chunk is delayed by `latency`
+    seconds plus up to `jitter`, and with probability `drop` a request
+    chunk is lost and the connection cut, like a peer going away.
+    """
+
+    def __init__(self, port, target_port, latency=0.0, jitter=0.0, drop=0.0, rng=None):
+        self.port = port
+        self.target_port = target_port
+        self.latency = latency
+        self.jitter = jitter
+        self.drop = drop
+        self.rng = rng or random.Random()
+        self.received = 0
+        self.sent = 0
+        self.dropped = 0
+        self.connections = 0
+        self.server = None
+        # Tasks of the open connections
+        self.handlers = set()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, '127.0.0.1', self.port)
+
+    async def close(self):
+        """
+        Stop accepting, and cut the open connections.
+        """
+        if self.server is None:
+            return
+        self.server.close()
+        handlers = list(self.handlers)
+        for handler in handlers:
+            handler.cancel()
+        await asyncio.gather(*handlers, return_exceptions=True)
+        await self.server.wait_closed()
+
+    def delay(self):
+        return self.latency + (self.rng.random() * self.jitter if self.jitter else 0.0)
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        handler = asyncio.current_task()
+        self.handlers.add(handler)
+        try:
+            try:
+                upstream_reader, upstream_writer = await asyncio.open_connection('127.0.0.1', self.target_port)
+            except OSError:
+                writer.close()
+                return
+            await asyncio.gather(self.pipe(reader, upstream_writer, writer, True),
+                                 self.pipe(upstream_reader, writer, upstream_writer, False),
+                                 return_exceptions=True)
+        finally:
+            self.handlers.discard(handler)
+
+    async def pipe(self, reader, writer, other_writer, request):
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+
+        async def deliver():
+            while True:
+                due, data = await queue.get()
+                if data is None:
+                    return
+                if due > loop.time():
+                    await asyncio.sleep(due - loop.time())
+                writer.write(data)
+                await writer.drain()
+
+        deliverer = loop.create_task(deliver())
+        last_due = 0.0
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                if request and self.drop and self.rng.random() < self.drop:
+                    self.dropped += 1
+                    other_writer.close()
+                    break
+                if request:
+                    self.received += len(data)
+                else:
+                    self.sent += len(data)
+                # Chunks are never reordered by the jitter
+                last_due = max(loop.time() + self.delay(), last_due)
+                queue.put_nowait((last_due, data))
+        finally:
+            queue.put_nowait((0.0, None))
+            try:
+                await deliverer
+            except (OSError, ConnectionError, asyncio.CancelledError):
+                deliverer.cancel()
+            writer.close()
+
+    def stats(self):
+        return {"bytes_received": self.received, "bytes_sent": self.sent,
+                "connections": self.connections, "dropped": self.dropped}
+
+
+def topology(kind, nodes, degree=2, rng=None):
+    """
+    Undirected links of the network.
+    :param kind: full, ring, line, star or random (a ring plus random links
+                 until every node has `degree` links)
+    """
+    rng = rng or random.Random()
+    if kind == 'full':
+        return set(itertools.combinations(range(nodes), 2))
+    if kind == 'line':
+        return {(i, i + 1) for i in range(nodes - 1)}
+    if kind == 'star':
+        return {(0, i) for i in range(1, nodes)}
+    links = {tuple(sorted((i, (i + 1) % nodes))) for i in range(nodes) if nodes > 1}
+    if kind == 'ring':
+        return links
+    if kind == 'random':
+        def links_of(node):
+            return sum(node in link for link in links)
+        for node in range(nodes):
+            others = [other for other in range(nodes) if other != node]
+            rng.shuffle(others)
+            for other in others:
+                if links_of(node) >= degree:
+                    break
+                links.add(tuple(sorted((node, other))))
+        return links
+    raise ValueError('Unknown topology {}'.format(kind))
+
+
+def percentiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+
+    def at(fraction):
+        return values[min(int(fraction * len(values)), len(values) - 1)]
+    return {"count": len(values), "mean": sum(values) / len(values), "p50": at(.5),
+            "p90": at(.9), "p99": at(.99), "max": values[-1]}
+
+
+class Simulator:
+    # Seconds between two polls of the nodes
+    poll_interval = 0.05
+
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.directory = os.path.dirname(os.path.abspath(__file__))
+        self.session = requests.Session()
+        self.executor = ThreadPoolExecutor(max(args.nodes, 8))
+        self.processes = []
+        self.proxies = []
+        self.loop = asyncio.new_event_loop()
+        self.accounts = [Signature.generate() for _ in range(args.accounts)]
+        # Signature -> (time sent, node it was sent to)
+        self.sent = {}
+        # (signature, node) -> time the node had it pending
+        self.seen = {}
+        # (node, index, hash) of every block mined
+        self.mined = []
+
+    def node_url(self, node):
+        return 'http://127.0.0.1:{}/'.format(self.args.base_port + 2 * node)
+
+    def peer_url(self, node):
+        return 'http://127.0.0.1:{}/'.format(self.args.base_port + 2 * node + 1)
+
+    def get(self, node, path, **kwargs):
+        return self.session.get(self.node_url(node) + path, timeout=self.args.timeout, **kwargs)
+
+    def post(self, node, path, payload):
+        return self.session.post(self.node_url(node) + path, json=payload, timeout=self.args.timeout)
+
+    def start(self):
+        Thread(target=self.loop.run_forever, daemon=True).start()
+        env = dict(os.environ, GENESIS_TIMESTAMP=str(int(time.time())),
+                   MINING_WORKERS=str(self.args.mining_workers), LOG_LEVEL='WARNING')
+        for node in range(self.args.nodes):
+            port = self.args.base_port + 2 * node
+            self.processes.append(subprocess.Popen(
+                [sys.executable, 'server.py', '--port', str(port), '--no-debug'],
+                cwd=self.directory, env=env,
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+            proxy = LinkProxy(port + 1, port, self.args.latency, self.args.jitter,
+                              self.args.drop, random.Random(self.rng.random()))
+            asyncio.run_coroutine_threadsafe(proxy.start(), self.loop).result()
+            self.proxies.append(proxy)
+        deadline = time.time() + 30
+        for node in range(self.args.nodes):
+            while True:
+                try:
+                    self.get(node, 'chain/length')
+                    break
+                except requests.RequestException:
+                    if time.time() > deadline:
+                        raise RuntimeError('Node {} did not start'.format(node))
+                    time.sleep(0.1)
+
+    def connect(self, links):
+        for a, b in links:
+            self.post(a, 'register_node', {"node_address": self.peer_url(b)}).raise_for_status()
+            self.post(b, 'register_node', {"node_address": self.peer_url(a)}).raise_for_status()
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        for proxy in self.proxies:
+            asyncio.run_coroutine_threadsafe(proxy.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.executor.shutdown()
+
+    def make_transaction(self):
+        (private_key, sender), (_, receiver) = self.rng.sample(self.accounts, 2)
+        tx = {"sender": sender, "receiver": receiver, "amount": self.rng.randint(1, 10)}
+        tx["signature"] = Signature.sign(private_key, signed_message(tx))
+        return tx
+
+    def send_transactions(self, count, rate):
+        """
+        Sign `count` transactions and send each to a random node, `rate` per second.
+        """
+        futures = []
+        started = time.time()
+        for i in range(count):
+            tx = self.make_transaction()
+            node = self.rng.randrange(self.args.nodes)
+            wait = started + i / rate - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            self.sent[tx["signature"]] = (time.time(), node)
+            futures.append(self.executor.submit(self.post, node, 'new_transaction', tx))
+        for future in futures:
+            future.result()
+
+    def poll_pending(self, node):
+        now = time.time()
+        for tx in self.get(node, 'pending_tx').json():
+            key = (tx["signature"], node)
+            if tx["signature"] in self.sent and key not in self.seen:
+                self.seen[key] = now
+
+    def poll(self, until):
+        """
+        Poll the pending transactions of every node until `until()` is true.
+        """
+        while not until():
+            list(self.executor.map(self.poll_pending, range(self.args.nodes)))
+            time.sleep(self.poll_interval)
+
+    def load(self, count, rate, timeout):
+        """
+        Send the load while watching the nodes, until every node has every
+        transaction pending or `timeout` seconds after the last one was sent.
+        :return: Signatures of the transactions sent
+        """
+        done = []
+        expected = set()
+        deadline = []
+
+        def until():
+            if not done:
+                return False
+            return expected <= self.seen.keys() or time.time() > deadline[0]
+
+        poller = Thread(target=self.poll, args=(until,))
+        poller.start()
+        before = set(self.sent)
+        try:
+            self.send_transactions(count, rate)
+        finally:
+            signatures = [signature for signature in self.sent if signature not in before]
+            expected.update((signature, node) for signature in signatures
+                            for node in range(self.args.nodes))
+            deadline.append(time.time() + timeout)
+            done.append(True)
+            poller.join()
+        return signatures
+
+    def propagation(self, signatures):
+        latencies = [self.seen[(signature, node)] - self.sent[signature][0]
+                     for signature in signatures for node in range(self.args.nodes)
+                     if node != self.sent[signature][1] and (signature, node) in self.seen]
+        pairs = len(signatures) * (self.args.nodes - 1)
+        return {"transactions": len(signatures),
+                "coverage": len(latencies) / pairs if pairs else 1.0,
+                "latency": percentiles(latencies)}
+
+    def mine(self, node):
+        response = self.get(node, 'mine', params={'wait': 1})
+        if not response.text.startswith('Block #'):
+            return
+        index = int(response.text.split('#')[1].split()[0])
+        block = self.get(node, 'block/{}'.format(index))
+        if block.status_code == 200:
+            self.mined.append((node, index, block.json()["hash"]))
+
+    def mining_rounds(self):
+        for _ in range(self.args.blocks):
+            self.send_transactions(self.args.round_transactions, self.args.rate)
+            time.sleep(self.args.mine_interval)
+            miners = self.rng.sample(range(self.args.nodes), min(self.args.miners, self.args.nodes))
+            list(self.executor.map(self.mine, miners))
+
+    def tips(self):
+        return [self.get(node, 'chain/length').json() for node in range(self.args.nodes)]
+
+    def wait_convergence(self, timeout):
+        """
+        :return: (seconds until every node has the same tip or None, tips)
+        """
+        started = time.time()
+        while True:
+            tips = self.tips()
+            if len({tip["hash"] for tip in tips}) == 1:
+                return time.time() - started, tips
+            if time.time() - started > timeout:
+                return None, tips
+            time.sleep(self.poll_interval)
+
+    def forks(self, tips):
+        best = max(range(self.args.nodes), key=lambda node: tips[node]["length"])
+        headers = self.get(best, 'headers', params={'since': 0, 'limit': tips[best]["length"]})
+        chain = {json.loads(line)["hash"] for line in headers.text.splitlines()[1:] if line}
+        orphaned = [hash for _, _, hash in self.mined if hash not in chain]
+        return {"mined": len(self.mined), "orphaned": len(orphaned),
+                "fork_rate": len(orphaned) / len(self.mined) if self.mined else 0.0}
+
+    def run(self):
+        args = self.args
+        links = topology(args.topology, args.nodes, args.degree, self.rng)
+        results = {"parameters": vars(args), "links": sorted(links)}
+        self.start()
+        try:
+            self.connect(links)
+            started = time.time()
+            signatures = self.load(args.transactions, args.rate, args.propagation_timeout)
+            results["load_seconds"] = time.time() - started
+            results["propagation"] = self.propagation(signatures)
+
+            self.mining_rounds()
+            # Concurrent rounds leave branches of the same length, the
+            # next block settles them
+            self.send_transactions(args.round_transactions, args.rate)
+            time.sleep(args.mine_interval)
+            self.mine(self.rng.randrange(args.nodes))
+            seconds, tips = self.wait_convergence(args.convergence_timeout)
+            results["convergence"] = {"converged": seconds is not None, "seconds": seconds,
+                                      "lengths": [tip["length"] for tip in tips]}
+            results["mining"] = self.forks(tips)
+            results["bandwidth"] = {self.peer_url(node): proxy.stats()
+                                    for node, proxy in enumerate(self.proxies)}
+            results["gossip"] = {self.peer_url(node): self.get(node, 'gossip').json()
+                                 for node in range(args.nodes)}
+        finally:
+            self.stop()
+        return results
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--nodes', type=int, default=4)
+    parser.add_argument('--topology', default='full', choices=['full', 'ring', 'line', 'star', 'random'])
+    parser.add_argument('--degree', type=int, default=2, help='links per node of the random topology')
+    parser.add_argument('--latency', type=float, default=0.02, help='one way delay of a link in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random extra delay in seconds')
+    parser.add_argument('--drop', type=float, default=0.0, help='probability to lose a request chunk')
+    parser.add_argument('--accounts', type=int, default=20, help='keys of the workload')
+    parser.add_argument('--transactions', type=int, default=200, help='transactions of the load phase')
+    parser.add_argument('--rate', type=float, default=50, help='transactions sent per second')
+    parser.add_argument('--blocks', type=int, default=10, help='mining rounds')
+    parser.add_argument('--miners', type=int, default=2, help='nodes mining at once in a round')
+    parser.add_argument('--round-transactions', type=int, default=5, help='transactions sent before a round')
+    parser.add_argument('--mine-interval', type=float, default=0.5, help='seconds before mining a round')
+    parser.add_argument('--mining-workers', type=int, default=1, help='mining processes per node')
+    parser.add_argument('--propagation-timeout', type=float, default=10)
+    parser.add_argument('--convergence-timeout', type=float, default=30)
+    parser.add_argument('--timeout', type=float, default=30, help='seconds before a request to a node fails')
+    parser.add_argument('--base-port', type=int, default=9000, help='node i listens on base + 2i, its proxy on base + 2i + 1')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--output', help='JSON file to write, standard output by default')
+    args = parser.parse_args()
+
+    output = json.dumps(Simulator(args).run(), indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
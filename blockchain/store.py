@@ -0,0 +1,259 @@
+from array import array
+from collections import OrderedDict
+import json
+import mmap
+import os
+import struct
+
+from block import Block
+
+# Offset and length of a record in the block log
+ENTRY = struct.Struct('<QI')
+
+
+class BlockStore:
+    """
+    Blocks on disk. `blocks.log` is an append-only log with the JSON of one
+    block per line, `blocks.idx` holds the offset and length of each
+    record, `snapshot.json` is the last checkpoint of the derived state and
+    `pending.json` a copy of the pending transactions. The log is
+    memory-mapped for random access.
+
+    Other processes can open the store `readonly` while the node writes to
+    it, and catch up with `refresh`.
+
+    Records are never overwritten while the store is open: a truncated
+    record stays in the log until the next start, and the index arrays are
+    replaced rather than shrunk, so `fragments` taken before a reorg keep
+    reading the blocks they were taken with.
+    """
+    # Number of parsed blocks kept in memory
+    cache_size = 256
+
+    def __init__(self, directory, readonly=False):
+        self.directory = directory
+        self.readonly = readonly
+        if readonly:
+            self._log = os.open(self._path('blocks.log'), os.O_RDONLY)
+            self._idx = os.open(self._path('blocks.idx'), os.O_RDONLY)
+        else:
+            os.makedirs(directory, exist_ok=True)
+            self._log = os.open(self._path('blocks.log'), os.O_RDWR | os.O_CREAT, 0o644)
+            self._idx = os.open(self._path('blocks.idx'), os.O_RDWR | os.O_CREAT, 0o644)
+        self.offsets = array('Q')
+        self.lengths = array('I')
+        self.end = 0
+        self._map = None
+        self._cache = OrderedDict()
+        # Size and modification time of the index when last read
+        self._stamp = None
+        self._load_index()
+        self.blocks = _StoreView(self, self.block)
+
+    @property
+    def fragments(self):
+        """
+        JSON of the blocks, read from the current index arrays. New blocks
+        show up in it, a truncation or a refresh doesn't.
+        """
+        return _FragmentView(self, self.offsets, self.lengths)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _read_index(self):
+        """
+        :return: (offsets, lengths) of the records fully written to the log
+        """
+        stat = os.fstat(self._idx)
+        self._stamp = (stat.st_size, stat.st_mtime_ns)
+        data = os.pread(self._idx, stat.st_size, 0)
+        log_size = os.fstat(self._log).st_size
+        offsets, lengths = array('Q'), array('I')
+        for offset, length in ENTRY.iter_unpack(data[:len(data) - len(data) % ENTRY.size]):
+            if offset + length > log_size:
+                break
+            offsets.append(offset)
+            lengths.append(length)
+        return offsets, lengths
+
+    def _load_index(self):
+        """
+        Read the index and drop whatever a crash left half written.
+        """
+        self.offsets, self.lengths = self._read_index()
+        if self.offsets:
+            self.end = self.offsets[-1] + self.lengths[-1]
+        if not self.readonly:
+            os.ftruncate(self._idx, len(self) * ENTRY.size)
+            os.ftruncate(self._log, self.end)
+
+    def refresh(self):
+        """
+        Catch up with the writer of a read-only store.
+        :return: Height of the first record that changed, None if none did
+        """
+        stat = os.fstat(self._idx)
+        if (stat.st_size, stat.st_mtime_ns) == self._stamp:
+            return None
+        offsets, lengths = self._read_index()
+        common = min(len(self), len(offsets))
+        if self.offsets[:common] != offsets[:common] or self.lengths[:common] != lengths[:common]:
+            common = next(height for height in range(common)
+                          if (self.offsets[height], self.lengths[height]) !=
+                          (offsets[height], lengths[height]))
+        if common == len(self) == len(offsets):
+            return None
+        self.offsets, self.lengths = offsets, lengths
+        self.end = self.offsets[-1] + self.lengths[-1] if self.offsets else 0
+        self.forget(common)
+        return common
+
+    def forget(self, height):
+        """
+        Drop the parsed blocks from `height` on, they changed on disk.
+        """
+        for cached in [h for h in self._cache if h >= height]:
+            del self._cache[cached]
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def append(self, block, fragment):
+        data = fragment.encode() + b'\n'
+        # The log is written before the index, a crash can't index a partial record
+        os.pwrite(self._log, data, self.end)
+        os.pwrite(self._idx, ENTRY.pack(self.end, len(data)), len(self) * ENTRY.size)
+        self.offsets.append(self.end)
+        self.lengths.append(len(data))
+        self.end += len(data)
+        self._remember(len(self) - 1, block)
+
+    def truncate(self, length):
+        """
+        Drop the blocks from `length` on. Their records stay in the log,
+        where running readers may still be streaming them, new records are
+        written after them. The next start reclaims them if they are last.
+        """
+        if length >= len(self):
+            return
+        self.offsets = self.offsets[:length]
+        self.lengths = self.lengths[:length]
+        os.ftruncate(self._idx, length * ENTRY.size)
+        self.forget(length)
+
+    def record(self, height) -> bytes:
+        return self.read(self.offsets[height], self.lengths[height])
+
+    def read(self, offset, length) -> bytes:
+        """
+        Record of `length` bytes at `offset` in the log, without its newline.
+        """
+        if self._map is None or len(self._map) < offset + length:
+            self._map = mmap.mmap(self._log, 0, access=mmap.ACCESS_READ)
+        return self._map[offset:offset + length - 1]
+
+    def block(self, height) -> Block:
+        block = self._cache.get(height)
+        if block is None:
+            block = Block.from_dict(json.loads(self.record(height)))
+            self._remember(height, block)
+        else:
+            self._cache.move_to_end(height)
+        return block
+
+    def _remember(self, height, block):
+        self._cache[height] = block
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def save_snapshot(self, state):
+        """
+        Atomically replace the checkpoint, after syncing the log it refers to.
+        """
+        os.fsync(self._log)
+        os.fsync(self._idx)
+        path = self._path('snapshot.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+    def load_snapshot(self):
+        """
+        :return: The last checkpoint, None if missing or ahead of the log
+        """
+        try:
+            with open(self._path('snapshot.json')) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state['length'] > len(self) or \
+                (state['length'] and state['hashes'][-1] != self.block(state['length'] - 1).hash):
+            return None
+        return state
+
+    def save_pending(self, transactions):
+        """
+        Replace the copy of the pending transactions. Not synced to disk,
+        the snapshot is what a restart relies on.
+        """
+        path = self._path('pending.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(transactions, f)
+        os.replace(path + '.tmp', path)
+
+    def load_pending(self, stamp=None):
+        """
+        :return: (modification time, transactions), None if unchanged since `stamp`
+        """
+        path = self._path('pending.json')
+        try:
+            modified = os.stat(path).st_mtime_ns
+            if modified == stamp:
+                return None
+            with open(path) as f:
+                return modified, json.load(f)
+        except (OSError, ValueError):
+            return None
+
+
+class _StoreView:
+    """
+    Read-only list-like access to the blocks or fragments of a store.
+    """
+
+    def __init__(self, store, getter):
+        self.store = store
+        self.getter = getter
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self.getter(i) for i in range(*item.indices(len(self)))]
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError('block index out of range')
+        return self.getter(item)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.getter(i)
+
+
+class _FragmentView(_StoreView):
+    """
+    JSON of the blocks indexed by the `offsets` and `lengths` arrays it was
+    made with, as a /chain stream needs it from start to end.
+    """
+
+    def __init__(self, store, offsets, lengths):
+        super().__init__(store, lambda height: store.read(offsets[height], lengths[height]).decode())
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets)
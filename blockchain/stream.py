@@ -0,0 +1,29 @@
+import zlib
+
+# Number of cached block fragments sent per chunk
+CHUNK_BLOCKS = 64
+
+
+def json_array(head, fragments, tail, stop=None):
+    """
+    Stream `head`, the first `stop` JSON fragments joined as an array body,
+    and `tail`. The fragment list itself is never copied.
+    """
+    stop = len(fragments) if stop is None else stop
+    yield head
+    for start in range(0, stop, CHUNK_BLOCKS):
+        chunk = ", ".join(fragments[start:min(start + CHUNK_BLOCKS, stop)])
+        yield chunk if start == 0 else ", " + chunk
+    yield tail
+
+
+def gzip_stream(chunks):
+    """
+    Gzip a stream of strings chunk by chunk.
+    """
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
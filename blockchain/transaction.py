@@ -0,0 +1,67 @@
+import json
+
+from metrics import Counter, Histogram, timed
+from signature import Signature
+
+REQUIRED_FIELDS = ['sender', 'receiver', 'amount', 'signature']
+# Fields added to a transaction after it was signed
+UNSIGNED_FIELDS = ('signature', 'claim', 'timestamp')
+
+VERIFY_SECONDS = Histogram('blockchain_signature_verify_seconds',
+                           'Time to check the signatures of a batch of transactions')
+SIGNATURES = Counter('blockchain_signatures_verified_total', 'Signatures checked')
+
+
+def signed_message(transaction) -> str:
+    """
+    The string the sender signed, i.e. the transaction without the fields
+    added afterwards by the sender and the nodes.
+    """
+    message = {k: v for k, v in transaction.items() if k not in UNSIGNED_FIELDS}
+    return json.dumps(message, sort_keys=True)
+
+
+def signature_items(transactions):
+    """
+    (public_key, signature, message) of every transaction, for
+    `Signature.verify_batch`.
+    """
+    return [(tx['sender'], tx['signature'], signed_message(tx))
+            for tx in transactions]
+
+
+def is_well_formed(transaction) -> bool:
+    """
+    The transaction has every required field with the right type: string
+    addresses and signature, a positive amount and, if any, a list of claims.
+    """
+    if not isinstance(transaction, dict) or not all(k in transaction for k in REQUIRED_FIELDS):
+        return False
+    amount = transaction['amount']
+    return isinstance(amount, (int, float)) and not isinstance(amount, bool) and amount > 0 and \
+        all(isinstance(transaction[k], str) for k in ('sender', 'receiver', 'signature')) and \
+        isinstance(transaction.get('claim', []), list)
+
+
+@timed(VERIFY_SECONDS)
+def verify_transactions(transactions) -> bool:
+    """
+    Check that every transaction is well formed and signed by its sender,
+    the signatures are verified as one batch.
+    """
+    if not all(is_well_formed(tx) for tx in transactions):
+        return False
+    SIGNATURES.inc(len(transactions))
+    return all(Signature.verify_batch(signature_items(transactions)))
+
+
+@timed(VERIFY_SECONDS)
+def verify_each(transactions) -> list:
+    """
+    Like `verify_transactions` but with the result of every transaction.
+    """
+    results = [is_well_formed(tx) for tx in transactions]
+    checked = [tx for tx, ok in zip(transactions, results) if ok]
+    SIGNATURES.inc(len(checked))
+    authentic = iter(Signature.verify_batch(signature_items(checked)))
+    return [ok and next(authentic) for ok in results]
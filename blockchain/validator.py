@@ -0,0 +1,106 @@
+from multiprocessing import Pool
+import os
+
+from block import Block
+
+
+def _verify_blocks(chain_dump, difficulty, max_transactions, max_bytes):
+    """
+    Check the proof of work and the size of every block in `chain_dump` on
+    its own.
+    :return: Position of the first invalid block, or None
+    """
+    target = '0' * difficulty
+    for position, block_data in enumerate(chain_dump):
+        block_hash = block_data['hash']
+        if not block_hash.startswith(target) or \
+                len(block_data['transactions']) > max_transactions:
+            return position
+        block = Block.from_dict(block_data)
+        if not block.fits(max_transactions, max_bytes) or not block.has_valid_merkle_root() or \
+                block_hash != block.compute_hash():
+            return position
+    return None
+
+
+class ChainValidator:
+    """
+    Validates chain dumps received from peers. It remembers the hashes of
+    the chain it already verified (the watermark is the highest one), so a
+    candidate chain sharing that prefix only has its new suffix checked.
+    """
+    # Below this many blocks the suffix is verified in the calling process
+    parallel_threshold = 64
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.hashes = []
+        self._pool = None
+
+    @property
+    def watermark(self):
+        """
+        (height, hash) of the highest verified block.
+        """
+        if not self.hashes:
+            return -1, None
+        return len(self.hashes) - 1, self.hashes[-1]
+
+    def reset(self, hashes):
+        """
+        Trust the chain made of the blocks with these hashes as fully verified.
+        """
+        self.hashes = list(hashes)
+
+    def mark(self, block):
+        """
+        Record a block that was verified and appended at `block.index`.
+        """
+        del self.hashes[block.index:]
+        self.hashes.append(block.hash)
+
+    def fork_point(self, chain_dump) -> int:
+        """
+        Binary search for the number of leading blocks of `chain_dump` that
+        match the verified hashes.
+        """
+        low, high = 0, min(len(chain_dump), len(self.hashes))
+        while low < high:
+            middle = (low + high + 1) // 2
+            if chain_dump[middle - 1]['hash'] == self.hashes[middle - 1]:
+                low = middle
+            else:
+                high = middle - 1
+        return low
+
+    def _verify_proofs(self, chain_dump, difficulty, max_transactions, max_bytes):
+        rules = (difficulty, max_transactions, max_bytes)
+        if self.workers == 1 or len(chain_dump) < self.parallel_threshold:
+            return _verify_blocks(chain_dump, *rules) is None
+
+        if self._pool is None:
+            self._pool = Pool(self.workers)
+        size = -(-len(chain_dump) // self.workers)
+        chunks = [chain_dump[i:i + size] for i in range(0, len(chain_dump), size)]
+        results = self._pool.starmap(_verify_blocks,
+                                     [(chunk,) + rules for chunk in chunks])
+        return all(result is None for result in results)
+
+    def verify(self, chain_dump, previous_hash, difficulty, max_transactions, max_bytes) -> bool:
+        """
+        Check that `chain_dump` is a valid extension of a block whose hash is
+        `previous_hash`, made of blocks of at most `max_transactions`
+        transactions and `max_bytes` bytes of them. Proofs and sizes are
+        independent and checked in parallel, the links between blocks are
+        checked here.
+        """
+        for block_data in chain_dump:
+            if block_data['previous_hash'] != previous_hash:
+                return False
+            previous_hash = block_data['hash']
+        return self._verify_proofs(chain_dump, difficulty, max_transactions, max_bytes)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
@@ -0,0 +1,197 @@
+import re
+import struct
+
+# Content-Type of the binary encoding, JSON stays the default
+BINARY_TYPE = 'application/x-blockchain'
+
+MAGIC = b'BC\x01'
+
+# Keys sent as one byte instead of a string
+KEYS = ['index', 'transactions', 'timestamp', 'previous_hash', 'hash', 'nonce',
+        'merkle_root', 'sender', 'receiver', 'amount', 'signature', 'claim',
+        'length', 'since', 'chain', 'blocks', 'peers']
+KEY_IDS = {key: i for i, key in enumerate(KEYS)}
+OTHER_KEY = 0xff
+
+# Lowercase hex strings are sent as raw bytes (32 bytes for a hash, 64 for
+# a signature) and turned back into the same string when decoded
+_HEX = re.compile('(?:[0-9a-f]{2})+')
+_DOUBLE = struct.Struct('>d')
+
+
+def _write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _write_bytes(out, data):
+    _write_varint(out, len(data))
+    out += data
+
+
+def _write_key(out, key):
+    key_id = KEY_IDS.get(key)
+    if key_id is None:
+        out.append(OTHER_KEY)
+        _write_bytes(out, key.encode())
+    else:
+        out.append(key_id)
+
+
+def _write(out, value):
+    if value is None:
+        out += b'N'
+    elif value is True:
+        out += b'T'
+    elif value is False:
+        out += b'F'
+    elif isinstance(value, int):
+        out += b'i'
+        _write_varint(out, value * 2 if value >= 0 else -value * 2 - 1)
+    elif isinstance(value, float):
+        out += b'd'
+        out += _DOUBLE.pack(value)
+    elif isinstance(value, str):
+        if _HEX.fullmatch(value):
+            out += b'h'
+            _write_bytes(out, bytes.fromhex(value))
+        else:
+            out += b's'
+            _write_bytes(out, value.encode())
+    elif isinstance(value, (list, tuple)):
+        # Items are length-prefixed so a reader can skip them
+        out += b'l'
+        _write_varint(out, len(value))
+        for item in value:
+            item_data = bytearray()
+            _write(item_data, item)
+            _write_bytes(out, item_data)
+    elif isinstance(value, dict):
+        out += b'm'
+        _write_varint(out, len(value))
+        for key, item in value.items():
+            _write_key(out, key)
+            _write(out, item)
+    else:
+        raise TypeError('Can not encode {}'.format(type(value).__name__))
+
+
+def dumps(value) -> bytes:
+    out = bytearray(MAGIC)
+    _write(out, value)
+    return bytes(out)
+
+
+def dumps_stream(fields, key, items, count):
+    """
+    Encode the dict `fields` plus `key` holding a list of `count` items,
+    one chunk per item, so a long list is never encoded at once. Decodes
+    like `dumps(dict(fields, key=list(items)))`.
+    """
+    out = bytearray(MAGIC)
+    out += b'm'
+    _write_varint(out, len(fields) + 1)
+    for field, value in fields.items():
+        _write_key(out, field)
+        _write(out, value)
+    _write_key(out, key)
+    out += b'l'
+    _write_varint(out, count)
+    yield bytes(out)
+    for item in items:
+        item_data = bytearray()
+        _write(item_data, item)
+        out = bytearray()
+        _write_bytes(out, item_data)
+        yield bytes(out)
+
+
+class _Reader:
+    def __init__(self, data):
+        self.data = bytes(data)
+        self.position = 0
+
+    def take(self, size):
+        end = self.position + size
+        if end > len(self.data):
+            raise ValueError('Truncated message')
+        chunk = self.data[self.position:end]
+        self.position = end
+        return chunk
+
+    def byte(self):
+        if self.position >= len(self.data):
+            raise ValueError('Truncated message')
+        self.position += 1
+        return self.data[self.position - 1]
+
+    def varint(self):
+        value = shift = 0
+        while True:
+            b = self.byte()
+            value |= (b & 0x7f) << shift
+            if b < 0x80:
+                return value
+            shift += 7
+
+    def bytes(self):
+        return self.take(self.varint())
+
+    def value(self):
+        tag = self.byte()
+        if tag == ord('N'):
+            return None
+        if tag == ord('T'):
+            return True
+        if tag == ord('F'):
+            return False
+        if tag == ord('i'):
+            value = self.varint()
+            return value >> 1 if not value & 1 else -((value + 1) >> 1)
+        if tag == ord('d'):
+            return _DOUBLE.unpack(self.take(8))[0]
+        if tag == ord('h'):
+            return self.bytes().hex()
+        if tag == ord('s'):
+            return self.bytes().decode()
+        if tag == ord('l'):
+            items = []
+            for _ in range(self.varint()):
+                end = self.varint() + self.position
+                items.append(self.value())
+                if self.position != end:
+                    raise ValueError('Bad item length')
+            return items
+        if tag == ord('m'):
+            value = {}
+            for _ in range(self.varint()):
+                key_id = self.byte()
+                if key_id == OTHER_KEY:
+                    key = self.bytes().decode()
+                elif key_id < len(KEYS):
+                    key = KEYS[key_id]
+                else:
+                    raise ValueError('Unknown key {}'.format(key_id))
+                value[key] = self.value()
+            return value
+        raise ValueError('Unknown tag {}'.format(tag))
+
+
+def loads(data):
+    """
+    Decode a binary message.
+    :raises ValueError: if the message is malformed
+    """
+    if bytes(data[:len(MAGIC)]) != MAGIC:
+        raise ValueError('Not a binary message')
+    reader = _Reader(data)
+    reader.position = len(MAGIC)
+    try:
+        value = reader.value()
+    except RecursionError:
+        raise ValueError('Message nested too deeply')
+    if reader.position != len(reader.data):
+        raise ValueError('Trailing data')
+    return value